@@ -0,0 +1,151 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, wraps
+
+import db
+
+DEFAULT_READERS = 4
+# most writes folded into one commit by the writer thread
+DEFAULT_MAX_BATCH = 256
+
+_STOP = object()
+
+def _reader(function):
+    @wraps(function)
+    async def call(self, *args, **kwargs):
+        return await self._read(function, *args, **kwargs)
+    return call
+
+def _writer(function):
+    @wraps(function)
+    async def call(self, *args, **kwargs):
+        return await self._write(function, *args, **kwargs)
+    return call
+
+class AsyncLibrary:
+    # asyncio front end for db.py. Every function of db.py is available as a coroutine
+    # with the same name, arguments and return value, e.g.
+    #
+    #     async with AsyncLibrary() as library:
+    #         book_id = await library.add_book("Dune", "Frank Herbert", 3)
+    #         books = await library.get_books_by_author("Frank Herbert")
+    #
+    # Reads run on a bounded pool of reader threads, each borrowing its own pooled
+    # connection, so the event loop never blocks on SQLite. Writes go through a single
+    # writer thread that drains everything queued so far and runs it in one transaction
+    # (group commit): many concurrent writers share one fsync, and each write is still
+    # isolated in its own savepoint, so one failing write does not undo the others.
+    def __init__(self, readers=DEFAULT_READERS, max_batch=DEFAULT_MAX_BATCH):
+        self.max_batch = max_batch
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="library-reader")
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="library-writer", daemon=True)
+        self._writer.start()
+        self._closed = False
+
+    async def _read(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, partial(function, *args, **kwargs))
+
+    async def _write(self, function, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("AsyncLibrary is closed")
+        future = Future()
+        self._writes.put((function, args, kwargs, future))
+        return await asyncio.wrap_future(future)
+
+    def _next_batch(self):
+        batch = [self._writes.get()]
+        while batch[-1] is not _STOP and len(batch) < self.max_batch:
+            try:
+                batch.append(self._writes.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+
+            results = []
+            try:
+                with db.transaction():
+                    for function, args, kwargs, future in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            with db.transaction():
+                                results.append((future, function(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # the commit itself failed, so none of the batch was written
+                for function, args, kwargs, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                results = []
+
+            # results are only handed out once they are durable
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+            if stop:
+                return
+
+    # Function to finish the queued writes and stop the reader and writer threads
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._writes.put(_STOP)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._writer.join)
+        self._readers.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    get_categories = _reader(db.get_categories)
+    get_category_ids = _reader(db.get_category_ids)
+    get_all_books = _reader(db.get_all_books)
+    get_books_page = _reader(db.get_books_page)
+    get_book_summaries_page = _reader(db.get_book_summaries_page)
+    get_book_summaries = _reader(db.get_book_summaries)
+    get_recent_reviews = _reader(db.get_recent_reviews)
+    get_books_by_author = _reader(db.get_books_by_author)
+    find_author = _reader(db.find_author)
+    get_book_by_id = _reader(db.get_book_by_id)
+    find_books_by_title = _reader(db.find_books_by_title)
+    search_books = _reader(db.search_books)
+    get_review_by_id = _reader(db.get_review_by_id)
+    get_book_stats = _reader(db.get_book_stats)
+    get_top_rated_books = _reader(db.get_top_rated_books)
+    get_recommendations = _reader(db.get_recommendations)
+    suggest_authors = _reader(db.suggest_authors)
+    suggest_titles = _reader(db.suggest_titles)
+    find_duplicate_authors = _reader(db.find_duplicate_authors)
+
+    insert_category = _writer(db.insert_category)
+    add_author = _writer(db.add_author)
+    add_book = _writer(db.add_book)
+    add_review = _writer(db.add_review)
+    update_book = _writer(db.update_book)
+    update_book_title = _writer(db.update_book_title)
+    update_book_author = _writer(db.update_book_author)
+    update_book_category = _writer(db.update_book_category)
+    delete_review = _writer(db.delete_review)
+    delete_book = _writer(db.delete_book)
+    delete_books = _writer(db.delete_books)
+    merge_authors = _writer(db.merge_authors)
+    rename_author = _writer(db.rename_author)
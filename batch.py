@@ -0,0 +1,228 @@
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field, is_dataclass
+
+import db
+from fuzzy import capitalize_words
+
+# Non-interactive versions of the ui.py menu operations, for scripts.
+#
+#     python ui.py batch commands.jsonl [--atomic]
+#     python ui.py add-book --title "The Hobbit" --author "J.R.R. Tolkien" --category-id 3
+#
+# A batch file has one JSON object per line, e.g.
+#     {"op": "add_book", "title": "The Hobbit", "author": "J.R.R. Tolkien", "category_id": 3}
+#     {"op": "add_review", "book_id": 12, "user_id": 7, "rating": 4.5, "review_text": "Lovely"}
+# Blank lines and lines starting with '#' are skipped.
+#
+# All commands run in one transaction, each in its own savepoint, so a failed command
+# is undone on its own and the rest are committed together at the end (with --atomic,
+# one failure rolls back everything). Category and book IDs are checked against sets
+# loaded once at the start and kept up to date as commands run, instead of asking the
+# database again for every command. The output is one JSON document with the result
+# and timing of every command.
+
+class CommandError(Exception):
+    pass
+
+class _Rollback(Exception):
+    pass
+
+@dataclass
+class CommandResult:
+    index: int
+    op: str
+    ok: bool
+    result: object = None
+    error: str = None
+    ms: float = 0.0
+
+@dataclass
+class BatchReport:
+    results: list = field(default_factory=list)
+    committed: bool = False
+    seconds: float = 0.0
+
+    @property
+    def failed(self):
+        return sum(1 for result in self.results if not result.ok)
+
+    def to_json(self):
+        return {"commands": len(self.results), "succeeded": len(self.results) - self.failed, "failed": self.failed,
+                "committed": self.committed, "seconds": round(self.seconds, 6),
+                "results": [asdict(result) for result in self.results]}
+
+# Records (slotted dataclasses) become JSON objects
+def _plain(value):
+    if is_dataclass(value):
+        return asdict(value)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+def _required(command, name, convert=str):
+    value = command.get(name)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise CommandError(f"missing '{name}'")
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise CommandError(f"invalid '{name}': {value!r}") from None
+
+def _optional(command, name, convert=str):
+    return None if command.get(name) is None else _required(command, name, convert)
+
+class BatchRunner:
+    # Runs commands against lookup sets loaded once: valid category IDs and existing book IDs
+    def __init__(self):
+        self._load()
+        self.operations = {
+            "add_book": self.add_book,
+            "add_author": self.add_author,
+            "add_category": self.add_category,
+            "add_review": self.add_review,
+            "update_book": self.update_book,
+            "delete_review": self.delete_review,
+            "delete_book": self.delete_book,
+            "books_by_author": self.books_by_author,
+            "books_by_category": self.books_by_category,
+            "search": self.search,
+        }
+
+    def _load(self):
+        self.category_ids = set(db.get_category_ids())
+        with db.reading() as cursor:
+            cursor.execute("SELECT book_id FROM Books")
+            self.book_ids = {book_id for book_id, in cursor.fetchall()}
+
+    def _category(self, command, name="category_id", required=True):
+        category_id = _required(command, name, int) if required else _optional(command, name, int)
+        if category_id is not None and category_id not in self.category_ids:
+            raise CommandError(f"invalid category ID {category_id}")
+        return category_id
+
+    def _book(self, command):
+        book_id = _required(command, "book_id", int)
+        if book_id not in self.book_ids:
+            raise CommandError(f"no book found with ID {book_id}")
+        return book_id
+
+    def add_book(self, command):
+        title = capitalize_words(_required(command, "title"))
+        author_name = capitalize_words(_required(command, "author"))
+        category_id = self._category(command)
+        book_id = db.add_book(title, author_name, category_id)
+        if book_id <= 0:
+            raise CommandError("invalid book (please check for duplicate entry)")
+        self.book_ids.add(book_id)
+        return book_id
+
+    def add_author(self, command):
+        author_id = db.add_author(capitalize_words(_required(command, "name")))
+        if not isinstance(author_id, int):
+            raise CommandError("author with the same name already exists")
+        return author_id
+
+    def add_category(self, command):
+        category_id = db.insert_category(capitalize_words(_required(command, "name")))
+        if not isinstance(category_id, int):
+            raise CommandError(category_id or "failed to add the category")
+        self.category_ids.add(category_id)
+        return category_id
+
+    def add_review(self, command):
+        book_id = self._book(command)
+        user_id = _required(command, "user_id", int)
+        rating = _required(command, "rating", float)
+        if not 0 <= rating <= 5:
+            raise CommandError("rating should be between 0 and 5")
+        review_id = db.add_review(book_id, user_id, rating, command.get("review_text", ""))
+        if not review_id:
+            raise CommandError("failed to add the review")
+        return review_id
+
+    def update_book(self, command):
+        book_id = self._book(command)
+        category_id = self._category(command, required=False)
+        if not db.update_book(book_id, _optional(command, "title"), _optional(command, "author"), category_id):
+            raise CommandError("failed to update the book")
+        return book_id
+
+    def delete_review(self, command):
+        review_id = _required(command, "review_id", int)
+        if not db.delete_review(review_id):
+            raise CommandError(f"review with ID {review_id} does not exist")
+        return review_id
+
+    def delete_book(self, command):
+        book_id = self._book(command)
+        if not db.delete_book(book_id):
+            raise CommandError("failed to delete the book")
+        self.book_ids.discard(book_id)
+        return book_id
+
+    def books_by_author(self, command):
+        return db.get_books_by_author(capitalize_words(_required(command, "author")))
+
+    def books_by_category(self, command):
+        return db.get_book_summaries(self._category(command))
+
+    def search(self, command):
+        return db.search_books(_required(command, "query"), limit=_optional(command, "limit", int) or 20)
+
+    def run_one(self, index, command):
+        start = time.perf_counter()
+        op = command.get("op") if isinstance(command, dict) else None
+        try:
+            operation = self.operations.get(op)
+            if operation is None:
+                raise CommandError(f"unknown operation: {op!r}")
+            result = CommandResult(index, op, True, result=_plain(operation(command)))
+        except CommandError as e:
+            result = CommandResult(index, op, False, error=str(e))
+        result.ms = round((time.perf_counter() - start) * 1000, 3)
+        return result
+
+    # Function to run commands in one transaction. With atomic=True the first failure
+    # rolls everything back. Returns a BatchReport.
+    def run(self, commands, atomic=False):
+        start = time.perf_counter()
+        report = BatchReport()
+        try:
+            with db.transaction():
+                for index, command in enumerate(commands):
+                    result = self.run_one(index, command)
+                    report.results.append(result)
+                    if atomic and not result.ok:
+                        raise _Rollback()
+            report.committed = True
+        except _Rollback:
+            # the sets may hold IDs that were rolled back
+            self._load()
+        report.seconds = time.perf_counter() - start
+        return report
+
+# Function to read commands from a JSON Lines file, or standard input for '-'
+def read_commands(path):
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {number}: {e}") from None
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+# Function to run commands and print the report as JSON. Returns the exit status:
+# 0 if every command succeeded, 1 otherwise.
+def run_and_print(commands, atomic=False, out=sys.stdout):
+    report = BatchRunner().run(commands, atomic=atomic)
+    json.dump(report.to_json(), out, indent=2, ensure_ascii=False)
+    out.write("\n")
+    return 0 if report.committed and not report.failed else 1
@@ -0,0 +1,438 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the public functions of db.py on reproducible synthetic libraries.
+#
+#     python benchmark.py --scales 1000,10000,100000 --output results.json
+#     python benchmark.py --scales 1000,10000 --compare results.json
+#     python benchmark.py --scales "" --author-scales 100000 --cold-start-repeats 0
+#
+# Each scale runs in a fresh process inside an empty temporary directory, so db.py
+# opens (and migrates) its own library.db there and nothing touches the real one.
+# Author scales measure only the author and title suggestions, in a library with that
+# many authors and a tenth as many books, since the other scales have ten books per author.
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+DEFAULT_AUTHOR_SCALES = [100000]
+# time spent on each operation per scale, and the bounds on how often it runs
+TIME_BUDGET = 0.5
+MIN_ITERATIONS = 3
+MAX_ITERATIONS = 2000
+
+WORDS = ("shadow", "river", "night", "garden", "silent", "winter", "empire", "glass", "stone", "letter",
+         "crown", "forest", "house", "secret", "storm", "mirror", "island", "fire", "ghost", "road")
+
+# Author names are a first name, picked with a Zipf-like skew as in a real catalog, and a
+# made-up surname. Common first names make common index keys, which fuzzy lookups must cope with.
+FIRST_NAMES = ("James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+               "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+               "Christopher", "Nancy", "Daniel", "Lisa", "Matthew", "Betty", "Anthony", "Margaret", "Mark", "Sandra",
+               "Donald", "Ashley", "Steven", "Emily", "Paul", "Donna", "Andrew", "Michelle", "Kenneth", "Dorothy",
+               "Kevin", "Carol", "Brian", "Amanda", "George", "Melissa", "Edward", "Deborah", "Ronald", "Stephanie",
+               "Timothy", "Rebecca", "Jason", "Sharon", "Jeffrey", "Laura", "Ryan", "Cynthia", "Jacob", "Kathleen")
+SURNAME_SYLLABLES = ("an", "ber", "ca", "dan", "el", "fer", "gan", "har", "in", "jo", "kel", "lan", "mar", "ney",
+                     "o", "per", "quin", "ros", "ter", "ul", "ven", "wal", "yor", "zel", "dre", "ski", "ton", "son",
+                     "ver", "ly", "ford", "ham", "well", "man", "berg", "stein", "ov", "ez", "ra", "li", "mo", "sha")
+# misspelled names and titles looked up per scale when measuring suggestion recall
+RECALL_SAMPLES = 200
+
+class CatalogSpec:
+    # Size of a synthetic library. Reviews are spread over books with a Zipf-like skew
+    # (a few books get most of the reviews, most books get few or none), like a real catalog.
+    def __init__(self, books, authors=None, categories=20, reviews=None, users=None, skew=1.1, seed=42):
+        self.books = books
+        self.authors = authors if authors is not None else max(1, books // 10)
+        self.categories = categories
+        self.reviews = reviews if reviews is not None else books * 3
+        self.users = users if users is not None else max(1, books // 5)
+        self.skew = skew
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+# Function to make the distinct author names of a library described by spec
+def author_names(spec):
+    rng = random.Random(spec.seed)
+    weights = [1.0 / rank for rank in range(1, len(FIRST_NAMES) + 1)]
+    names = []
+    seen = set()
+    while len(names) < spec.authors:
+        surname = "".join(rng.choice(SURNAME_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        name = f"{rng.choices(FIRST_NAMES, weights)[0]} {surname.capitalize()}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+# Function to misspell text by one letter: deleted, replaced or inserted
+def misspell(text, rng):
+    position = rng.randrange(len(text))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    edit = rng.choice(("delete", "replace", "insert"))
+    if edit == "delete":
+        return text[:position] + text[position + 1:]
+    if edit == "replace":
+        return text[:position] + letter + text[position + 1:]
+    return text[:position] + letter + text[position:]
+
+# Function to fill an empty database with a synthetic library described by spec
+def generate_catalog(conn, spec):
+    import fuzzy
+
+    rng = random.Random(spec.seed)
+    title = lambda: " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 4)))
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO Categories (category_name) VALUES (?)",
+                     ((f"Category {i}",) for i in range(1, spec.categories + 1)))
+    conn.executemany("INSERT INTO Authors (author_name) VALUES (?)",
+                     ((name,) for name in author_names(spec)))
+    conn.executemany("INSERT INTO Books (title, author_id, category_id) VALUES (?, ?, ?)",
+                     ((f"{title()} {i}", rng.randint(1, spec.authors), rng.randint(1, spec.categories))
+                      for i in range(1, spec.books + 1)))
+    fuzzy.index_authors(conn, conn.execute("SELECT author_id, author_name FROM Authors").fetchall())
+    fuzzy.bulk_index_titles(conn, conn.execute("SELECT book_id, title FROM Books").fetchall())
+
+    # book k gets a review with probability proportional to 1 / k^skew
+    weights = [1.0 / (rank ** spec.skew) for rank in range(1, spec.books + 1)]
+    book_ids = list(range(1, spec.books + 1))
+    rng.shuffle(book_ids)
+    total = 0.0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    reviewed = rng.choices(book_ids, cum_weights=cumulative, k=spec.reviews)
+    conn.executemany("INSERT INTO Reviews (book_id, user_id, rating, review_text) VALUES (?, ?, ?, ?)",
+                     ((book_id, rng.randint(1, spec.users), rng.randint(0, 5), f"{title()} review")
+                      for book_id in reviewed))
+    conn.execute("COMMIT")
+
+def _measure(function, make_args):
+    samples = []
+    deadline = time.perf_counter() + TIME_BUDGET
+    while len(samples) < MAX_ITERATIONS and (len(samples) < MIN_ITERATIONS or time.perf_counter() < deadline):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "iterations": len(samples),
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6,
+        "min_us": samples[0] * 1e6,
+    }
+
+# Function to time every public db.py operation against the current database
+def run_operations(db, spec):
+    rng = random.Random(spec.seed + 1)
+    book = lambda: rng.randint(1, spec.books)
+    category = lambda: rng.randint(1, spec.categories)
+    names = author_names(spec)
+    author = lambda: rng.choice(names)
+    counter = iter(range(1, 10 ** 9))
+
+    with db.reading() as cursor:
+        cursor.execute("SELECT title FROM Books WHERE book_id = ?", (spec.books // 2 or 1,))
+        known_title = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(review_id) FROM Reviews")
+        last_review = cursor.fetchone()[0] or 0
+
+    operations = [
+        # reads
+        ("get_categories", db.get_categories, lambda: ()),
+        ("get_all_books", db.get_all_books, lambda: ()),
+        ("get_all_books(category)", db.get_all_books, lambda: (category(),)),
+        ("get_all_books(raw)", db.get_all_books, lambda: (None, True)),
+        ("get_books_page", db.get_books_page, lambda: (book(),)),
+        ("get_books_page(category)", db.get_books_page, lambda: (0, db.BOOK_PAGE_SIZE, category())),
+        ("get_book_summaries_page", db.get_book_summaries_page, lambda: (book(),)),
+        ("get_book_summaries_page(category)", db.get_book_summaries_page, lambda: (0, db.BOOK_PAGE_SIZE, category())),
+        ("get_book_summaries", db.get_book_summaries, lambda: ()),
+        ("get_book_summaries(columnar)", db.get_book_summaries, lambda: (None, True)),
+        ("get_recent_reviews", db.get_recent_reviews, lambda: (book(),)),
+        ("get_books_by_author", db.get_books_by_author, lambda: (author(),)),
+        ("get_book_by_id", db.get_book_by_id, lambda: (book(),)),
+        ("get_review_by_id", db.get_review_by_id, lambda: (rng.randint(1, max(1, last_review)),)),
+        ("find_books_by_title", db.find_books_by_title, lambda: (known_title,)),
+        ("find_books_by_title(prefix, nocase)", db.find_books_by_title, lambda: (rng.choice(WORDS), True, True)),
+        ("search_books", db.search_books, lambda: (rng.choice(WORDS),)),
+        ("get_book_stats", db.get_book_stats, lambda: (book(),)),
+        ("get_top_rated_books", db.get_top_rated_books, lambda: ()),
+        ("get_top_rated_books(category)", db.get_top_rated_books, lambda: (category(),)),
+        ("get_recommendations", db.get_recommendations, lambda: (book(),)),
+        ("suggest_authors", db.suggest_authors, lambda: (misspell(author(), rng),)),
+        ("suggest_titles", db.suggest_titles, lambda: (f"{rng.choice(WORDS)} {rng.choice(WORDS)}",)),
+        # writes
+        ("insert_category", db.insert_category, lambda: (f"Bench Category {next(counter)}",)),
+        ("add_author", db.add_author, lambda: (f"Bench Author {next(counter)}",)),
+        ("add_book", db.add_book, lambda: (f"Bench Book {next(counter)}", author(), category())),
+        ("add_review", db.add_review, lambda: (book(), 1, rng.randint(0, 5), "benchmark review")),
+        ("update_book_title", db.update_book_title, lambda: (book(), f"Renamed {next(counter)}")),
+        ("update_book_author", db.update_book_author, lambda: (book(), author())),
+        ("update_book_category", db.update_book_category, lambda: (book(), category())),
+        ("update_book", db.update_book, lambda: (book(), f"Edited {next(counter)}", author(), category())),
+        ("delete_review", db.delete_review, lambda: (rng.randint(1, max(1, last_review)),)),
+        ("delete_book", db.delete_book, lambda: (book(),)),
+        ("delete_books(100)", db.delete_books, lambda: ([book() for _ in range(100)],)),
+    ]
+
+    results = {}
+    for name, function, make_args in operations:
+        results[name] = _measure(function, make_args)
+    return results
+
+# Function to measure how often "did you mean" finds what was meant: the share of
+# misspelled author names and titles whose author or book is among the suggestions,
+# reported with the time the lookups took
+def measure_suggestion_recall(db, spec, samples=RECALL_SAMPLES):
+    rng = random.Random(spec.seed + 2)
+    names = author_names(spec)
+    with db.reading() as cursor:
+        cursor.execute("SELECT book_id, title FROM Books ORDER BY book_id")
+        titles = cursor.fetchall()
+    cases = {
+        "suggest_authors": (db.suggest_authors, [(author_id, names[author_id - 1])
+                                                 for author_id in rng.sample(range(1, len(names) + 1), min(samples, len(names)))]),
+        "suggest_titles": (db.suggest_titles, rng.sample(titles, min(samples, len(titles)))),
+    }
+    results = {}
+    for name, (function, targets) in cases.items():
+        found = 0
+        times = []
+        for target_id, text in targets:
+            start = time.perf_counter()
+            matches = function(misspell(text, rng))
+            times.append(time.perf_counter() - start)
+            found += any(match.id == target_id for match in matches)
+        times.sort()
+        results[name] = {
+            "lookups": len(targets),
+            "recall": found / len(targets) if targets else 0.0,
+            "median_us": statistics.median(times) * 1e6 if times else 0.0,
+            "p95_us": times[min(len(times) - 1, int(len(times) * 0.95))] * 1e6 if times else 0.0,
+        }
+    return results
+
+# Function to measure the memory held by a full catalog listing, as records and as plain tuples
+def measure_listing_memory(db):
+    results = {}
+    for name, raw in (("records", False), ("tuples", True)):
+        tracemalloc.start()
+        rows = db.get_all_books(raw=raw)
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "rows": len(rows),
+            "held_bytes": held,
+            "peak_bytes": peak,
+            "bytes_per_row": held / len(rows) if rows else 0.0,
+        }
+        del rows
+    return results
+
+# Runs one scale inside the current directory (called in a child process)
+def _worker(books, seed):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import db
+    import migrations
+
+    spec = CatalogSpec(books, seed=seed)
+    start = time.perf_counter()
+    with db.get_pool().connection() as conn:
+        generate_catalog(conn, spec)
+    generate_seconds = time.perf_counter() - start
+    # timings are meaningless if a hot query fell back to a table scan, so stop right there
+    with db.get_pool().connection() as conn:
+        migrations.check_query_plans(conn)
+    results = {
+        "catalog": spec.as_dict(),
+        "generate_seconds": generate_seconds,
+        "listing_memory": measure_listing_memory(db),
+        "suggestion_recall": measure_suggestion_recall(db, spec),
+        "operations": run_operations(db, spec),
+    }
+    db.close()
+    json.dump(results, sys.stdout)
+
+# Runs one author scale inside the current directory (called in a child process)
+def _author_worker(authors, seed):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import db
+    import migrations
+
+    spec = CatalogSpec(max(1, authors // 10), authors=authors, seed=seed)
+    start = time.perf_counter()
+    with db.get_pool().connection() as conn:
+        generate_catalog(conn, spec)
+    generate_seconds = time.perf_counter() - start
+    with db.get_pool().connection() as conn:
+        migrations.check_query_plans(conn)
+    results = {
+        "catalog": spec.as_dict(),
+        "generate_seconds": generate_seconds,
+        "suggestion_recall": measure_suggestion_recall(db, spec),
+    }
+    db.close()
+    json.dump(results, sys.stdout)
+
+# Startup scenarios for the cold-start benchmark: each runs in a new interpreter. The
+# existing-file ones run where an up-to-date library.db has already been created.
+COLD_START_SCENARIOS = [
+    ("python", "pass", False),
+    ("import db", "import db", False),
+    ("import ui", "import ui", False),
+    ("first query, :memory:", "import db; db.configure(':memory:'); db.get_categories()", False),
+    ("first query, new file", "import db; db.get_categories()", False),
+    ("first query, existing file", "import db; db.get_categories()", True),
+]
+COLD_START_REPEATS = 10
+
+# Function to time how long a new process takes to import db.py (and ui.py) and run a first query
+def run_cold_start(repeats=COLD_START_REPEATS):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+    env.pop("LIBRARY_DB", None)
+    results = {}
+    with tempfile.TemporaryDirectory() as existing:
+        subprocess.run([sys.executable, "-c", "import db; db.get_categories(); db.close()"],
+                       cwd=existing, env=env, check=True)
+        for name, code, in_existing in COLD_START_SCENARIOS:
+            samples = []
+            for _ in range(repeats):
+                with tempfile.TemporaryDirectory() as fresh:
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, "-c", code], cwd=existing if in_existing else fresh,
+                                   env=env, check=True)
+                    samples.append(time.perf_counter() - start)
+            results[name] = {"median_ms": statistics.median(samples) * 1000, "min_ms": min(samples) * 1000}
+    return results
+
+def _run_worker(flag, size, seed):
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), flag, str(size), "--seed", str(seed)],
+                                cwd=workdir, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+# Function to benchmark every scale, each in a fresh process and database
+def run_benchmarks(scales=DEFAULT_SCALES, seed=42, cold_start_repeats=COLD_START_REPEATS,
+                   author_scales=DEFAULT_AUTHOR_SCALES):
+    report = {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": seed,
+        "scales": {},
+        "author_scales": {},
+    }
+    if cold_start_repeats:
+        report["cold_start"] = run_cold_start(cold_start_repeats)
+    for books in scales:
+        report["scales"][str(books)] = _run_worker("--worker", books, seed)
+        print(f"{books} books: done", file=sys.stderr)
+    for authors in author_scales:
+        report["author_scales"][str(authors)] = _run_worker("--author-worker", authors, seed)
+        print(f"{authors} authors: done", file=sys.stderr)
+    return report
+
+# Function to print how each operation changed between two benchmark reports
+def compare(old, new):
+    for name, timing in new.get("cold_start", {}).items():
+        before = old.get("cold_start", {}).get(name)
+        if before is not None:
+            print(f"  cold start: {name:<28}{before['median_ms']:>12.1f}ms ->{timing['median_ms']:>12.1f}ms")
+    for scale, results in new["scales"].items():
+        previous = old.get("scales", {}).get(scale)
+        if previous is None:
+            continue
+        print(f"{scale} books")
+        for name, timing in results["operations"].items():
+            before = previous["operations"].get(name)
+            if before is None:
+                continue
+            ratio = timing["median_us"] / before["median_us"] if before["median_us"] else float("inf")
+            print(f"  {name:<40}{before['median_us']:>12.1f}us ->{timing['median_us']:>12.1f}us  x{ratio:.2f}")
+        _compare_recall(previous, results)
+    for scale, results in new.get("author_scales", {}).items():
+        previous = old.get("author_scales", {}).get(scale)
+        if previous is None:
+            continue
+        print(f"{scale} authors")
+        _compare_recall(previous, results)
+
+def _compare_recall(previous, results):
+    for name, recall in results.get("suggestion_recall", {}).items():
+        before = previous.get("suggestion_recall", {}).get(name)
+        if before is not None:
+            print(f"  {name + ' recall':<40}{before['recall']:>14.3f} ->{recall['recall']:>14.3f}")
+            print(f"  {name + ' median':<40}{before['median_us']:>12.1f}us ->{recall['median_us']:>12.1f}us")
+
+def print_report(report):
+    for name, timing in report.get("cold_start", {}).items():
+        print(f"cold start: {name:<30}{timing['median_ms']:>10.1f}ms median {timing['min_ms']:>10.1f}ms min")
+    for scale, results in report["scales"].items():
+        print(f"{scale} books (generated in {results['generate_seconds']:.2f}s)")
+        for name, timing in results["operations"].items():
+            print(f"  {name:<40}{timing['median_us']:>12.1f}us median {timing['p95_us']:>12.1f}us p95")
+        for name, memory in results.get("listing_memory", {}).items():
+            print(f"  get_all_books memory ({name}):{'':<10}{memory['bytes_per_row']:>9.1f} bytes/row "
+                  f"{memory['peak_bytes'] / 1e6:>9.1f}MB peak")
+        _print_recall(results)
+    for scale, results in report.get("author_scales", {}).items():
+        print(f"{scale} authors (generated in {results['generate_seconds']:.2f}s)")
+        _print_recall(results)
+
+def _print_recall(results):
+    for name, recall in results.get("suggestion_recall", {}).items():
+        print(f"  {name} recall (one typo):{'':<13}{recall['recall']:>9.3f} "
+              f"{recall['median_us']:>12.1f}us median {recall['p95_us']:>12.1f}us p95")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark db.py on synthetic libraries.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="comma separated numbers of books")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--cold-start-repeats", type=int, default=COLD_START_REPEATS,
+                        help="process starts timed per cold-start scenario (0 to skip)")
+    parser.add_argument("--author-scales", default=",".join(map(str, DEFAULT_AUTHOR_SCALES)),
+                        help="comma separated numbers of authors for the suggestion benchmark")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--author-worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        _worker(args.worker, args.seed)
+        return 0
+    if args.author_worker is not None:
+        _author_worker(args.author_worker, args.seed)
+        return 0
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+    author_scales = [int(scale) for scale in args.author_scales.split(",") if scale]
+    report = run_benchmarks(scales, args.seed, args.cold_start_repeats, author_scales)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    else:
+        print_report(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache:
+    # A small thread-safe least-recently-used cache with hit/miss counters, used by
+    # db.py for hot reference data (categories, author name -> ID). Once maxsize
+    # entries are stored, adding one evicts the entry that was used longest ago.
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # Function to return the cached value, calling load() and caching its result on a miss
+    def get_or_load(self, key, load):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = load()
+            self.put(key, value)
+        return value
+
+    # Function to drop one key, or everything when no key is given
+    def invalidate(self, key=_MISSING):
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,158 @@
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+import db
+
+# Cleanup of rows nothing refers to any more, and handing the freed space back.
+#
+# Reviews are deleted together with their book (ON DELETE CASCADE). Authors and
+# categories are kept, since they may be added before their first book, but when a
+# book is deleted or moved a trigger queues its old author and category in
+# CleanupQueue. compact() checks only those, each with one lookup in idx_books_author
+# or idx_books_category, deletes the ones left without books, and then runs an
+# incremental VACUUM a batch of pages at a time.
+#
+# That includes categories a librarian created on purpose: once the last book of a
+# category is deleted or moved to another one, the next compaction deletes the category
+# too, and it has to be added again before new books can go in it. Programs running
+# while compact.py deletes rows notice on their own: a write with the ID of a deleted
+# author or category fails on its foreign key, which makes db.py drop its caches, and
+# db.py tries writes with cached author IDs once more after that.
+#
+#     python compact.py
+#     python compact.py enable-incremental-vacuum
+
+logger = logging.getLogger("library.compact")
+
+# queued authors/categories checked per transaction, and pages vacuumed per transaction
+BATCH_SIZE = 1000
+VACUUM_PAGES = 1000
+
+@dataclass
+class CompactionStep:
+    name: str
+    rows: int = 0
+    bytes_reclaimed: int = 0
+    unit: str = "rows"
+
+    def __str__(self):
+        return f"{self.name}: {self.rows} {self.unit} removed, {self.bytes_reclaimed / 1024:,.1f} KiB reclaimed"
+
+@dataclass
+class CompactionReport:
+    steps: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def bytes_reclaimed(self):
+        return sum(step.bytes_reclaimed for step in self.steps)
+
+    def __str__(self):
+        lines = [str(step) for step in self.steps]
+        lines.append(f"Finished in {self.seconds:.2f}s.")
+        return "\n".join(lines)
+
+def _pragma(cursor, name):
+    cursor.execute(f"PRAGMA {name}")
+    return cursor.fetchone()[0]
+
+# Deletes the queued authors or categories that no book uses any more. Space freed by a
+# delete shows up as pages on the free list, which the vacuum step then hands back.
+def _purge(kind, table, id_column, book_column):
+    step = CompactionStep(f"unused {table.lower()}")
+    while True:
+        with db.transaction() as cursor:
+            cursor.execute("SELECT id FROM CleanupQueue WHERE kind = ? LIMIT ?", (kind, BATCH_SIZE))
+            candidates = [(candidate,) for candidate, in cursor.fetchall()]
+            if not candidates:
+                return step
+            free_pages = _pragma(cursor, "freelist_count")
+            cursor.executemany(f'''DELETE FROM {table} WHERE {id_column} = ?1
+                                 AND NOT EXISTS (SELECT 1 FROM Books WHERE {book_column} = ?1)''', candidates)
+            step.rows += cursor.rowcount
+            cursor.executemany("DELETE FROM CleanupQueue WHERE kind = ? AND id = ?",
+                               ((kind, candidate) for candidate, in candidates))
+            step.bytes_reclaimed += (_pragma(cursor, "freelist_count") - free_pages) * _pragma(cursor, "page_size")
+
+# Hands free pages back to the file system, VACUUM_PAGES per transaction
+def _incremental_vacuum():
+    step = CompactionStep("incremental vacuum", unit="pages")
+    with db.reading() as cursor:
+        if _pragma(cursor, "auto_vacuum") != 2:
+            logger.warning("auto_vacuum is not INCREMENTAL, so freed pages stay in the file; "
+                           "run 'python compact.py enable-incremental-vacuum' once to turn it on")
+            return step
+    while True:
+        with db.transaction() as cursor:
+            page_count = _pragma(cursor, "page_count")
+            if _pragma(cursor, "freelist_count") == 0:
+                return step
+            cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            cursor.fetchall()
+            released = page_count - _pragma(cursor, "page_count")
+            step.rows += released
+            step.bytes_reclaimed += released * _pragma(cursor, "page_size")
+
+# Function to purge unused authors and categories (including empty categories created
+# on purpose, see above) and hand the freed space back. Returns a CompactionReport with
+# the rows removed and the bytes reclaimed by each step.
+def compact():
+    start = time.perf_counter()
+    report = CompactionReport()
+    report.steps.append(_purge("author", "Authors", "author_id", "author_id"))
+    report.steps.append(_purge("category", "Categories", "category_id", "category_id"))
+    if report.steps[0].rows or report.steps[1].rows:
+        db.invalidate_caches()
+    report.steps.append(_incremental_vacuum())
+    report.seconds = time.perf_counter() - start
+    return report
+
+# Function to switch an existing database to incremental auto-vacuum. SQLite only applies
+# the setting during a full VACUUM, which rewrites the whole file and blocks writers, so
+# this is a one-off maintenance step. Returns the bytes reclaimed by the VACUUM.
+def enable_incremental_vacuum():
+    with db.get_pool().connection() as conn:
+        size = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return size - conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+class BackgroundCompaction(threading.Thread):
+    # Calls compact() every interval seconds until stop() is called
+    def __init__(self, interval=3600.0):
+        super().__init__(name="library-compaction", daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                report = compact()
+                logger.info("Compaction reclaimed %d bytes:\n%s", report.bytes_reclaimed, report)
+            except Exception as e:
+                logger.error("Error compacting the database: %s", e)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "run"
+    try:
+        if command == "run":
+            print(compact())
+        elif command == "enable-incremental-vacuum":
+            print(f"Incremental vacuum enabled, {enable_incremental_vacuum() / 1024:,.1f} KiB reclaimed.")
+        else:
+            print("Usage: python compact.py [run|enable-incremental-vacuum]")
+            return 2
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
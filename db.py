@@ -1,170 +1,601 @@
+import logging
+import os
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-# this will create a new database because we do not already have one
-conn = sqlite3.connect('library.db')
-cursor = conn.cursor()
-
-# creating the categories table
-cursor.execute('''CREATE TABLE IF NOT EXISTS Categories (
-    category_id INTEGER PRIMARY KEY,
-    category_name TEXT
-)''')
-
-# creating the authors table
-cursor.execute('''CREATE TABLE IF NOT EXISTS Authors (
-    author_id INTEGER PRIMARY KEY,
-    author_name TEXT
-)''')
-
-# creating the books table with foreign keys
-cursor.execute('''CREATE TABLE IF NOT EXISTS Books (
-    book_id INTEGER PRIMARY KEY,
-    title TEXT,
-    author_id INTEGER,
-    category_id INTEGER,
-    FOREIGN KEY (author_id) REFERENCES Authors (author_id),
-    FOREIGN KEY (category_id) REFERENCES Categories (category_id)
-)''')
-
-# creating the reviews table with a foreign key
-cursor.execute('''CREATE TABLE IF NOT EXISTS Reviews (
-    review_id INTEGER PRIMARY KEY,
-    book_id INTEGER,
-    user_id INTEGER,
-    rating INTEGER,
-    review_text TEXT,
-    FOREIGN KEY (book_id) REFERENCES Books (book_id)
-)''')
+import fuzzy
+import instrument
+from cache import LRUCache
+from instrument import timed
+from migrations import migrate
+from objects import Author, AuthorMatch, Book, BookDetails, BookListing, BookStats, BookSummary, Category, RatedBook, Recommendation, Review, SearchResult, TitleMatch
+from pool import DEFAULT_MAX_CONNECTIONS, ConnectionPool
+
+# the database used unless configure() picks another one; LIBRARY_DB overrides it
+DB_PATH = os.environ.get("LIBRARY_DB", 'library.db')
+
+# errors are logged here instead of raised; without a logging configuration they still go to stderr
+logger = logging.getLogger("library.db")
+
+# Importing this module touches no files: the pool is created by configure() or on
+# first use, and it opens connections on demand. The first connection creates the
+# tables on a new database and brings an existing one up to date. Cursors are timed
+# while instrument.enable() is in effect.
+pool = None
+_pool_lock = threading.Lock()
+
+def _in_memory(path, uri):
+    return path == ":memory:" or (uri and "mode=memory" in path)
+
+def _open_pool(path, uri, max_connections):
+    global pool
+    if max_connections is None:
+        max_connections = 1 if _in_memory(path, uri) else DEFAULT_MAX_CONNECTIONS
+    pool = ConnectionPool(path, max_connections=max_connections, initialize=migrate, uri=uri,
+                          factory=instrument.Connection)
+    return pool
+
+# Function to choose the database, e.g. configure(":memory:") for tests or
+# configure("file:library.db?mode=ro", uri=True), closing the previous one's connections.
+# A read-only database is not migrated, so it has to be up to date already (a snapshot
+# from export.snapshot() is).
+# Every connection to a private in-memory database is a separate database, so those
+# get a pool of one connection, which all threads take turns with.
+def configure(path=None, uri=False, max_connections=None):
+    with _pool_lock:
+        if pool is not None:
+            pool.close()
+        _open_pool(DB_PATH if path is None else path, uri, max_connections)
+    invalidate_caches()
+    return pool
+
+# Function to return the connection pool, opening DB_PATH on first use
+def get_pool():
+    current = pool
+    if current is None:
+        with _pool_lock:
+            current = pool if pool is not None else _open_pool(DB_PATH, False, None)
+    return current
+
+# read-through caches for the small, hot reference tables; the write functions below
+# keep them current, and anything that writes these tables directly (the bulk importer,
+# maintenance jobs) should call invalidate_caches() afterwards
+category_cache = LRUCache(maxsize=4)
+author_cache = LRUCache(maxsize=10000)
+
+# Function to drop everything cached from the reference tables
+def invalidate_caches():
+    category_cache.invalidate()
+    author_cache.invalidate()
+
+# Function to return hit/miss counters of the reference caches
+def cache_stats():
+    return {"categories": category_cache.stats(), "authors": author_cache.stats()}
+
+# Row factory that builds one record (a dataclass from objects.py) per result row
+def _records(record_type):
+    return lambda cursor, row: record_type(*row)
+
+# Row factory for catalog listings, where a book's title, author and category come back
+# once per review: equal strings are shared between rows instead of kept once per row.
+# With raw=True the rows stay plain tuples, with the same strings shared.
+def _listing_records(raw=False):
+    shared = {}
+    def record(cursor, row):
+        book_id, title, author_name, category_name, rating, review_text = row
+        fields = (book_id, shared.setdefault(title, title), shared.setdefault(author_name, author_name),
+                  shared.setdefault(category_name, category_name), rating, review_text)
+        return fields if raw else BookListing(*fields)
+    return record
+
+# Context manager that yields a cursor for reading, returning rows through row_factory
+# if one is given (plain tuples otherwise). Inside a transaction() on the same thread
+# it reads through that transaction's connection.
+@contextmanager
+def reading(row_factory=None):
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+# per-thread transaction nesting depth and deferred-commit state
+_local = threading.local()
+
+# A write drops the cache right away, so the writing thread sees its own change, and
+# again once the change is committed, in case another thread reloaded the old rows meanwhile
+def _cache_changed(cache):
+    cache.invalidate()
+    stale = getattr(_local, "stale_caches", None)
+    if stale is None:
+        stale = _local.stale_caches = set()
+    stale.add(cache)
+
+def _committed():
+    for cache in getattr(_local, "stale_caches", None) or ():
+        cache.invalidate()
+    _local.stale_caches = None
+
+def _rolled_back():
+    # author IDs are cached as they are inserted, so forget everything that may have been rolled back
+    invalidate_caches()
+    _local.stale_caches = None
+
+# Context manager that yields a cursor inside a write transaction, committed when the
+# block ends and rolled back if it raises. BEGIN IMMEDIATE takes the write lock up
+# front, so two writers wait on the busy timeout instead of deadlocking. Nested calls
+# on the same thread become savepoints of the outer transaction, so wrapping several
+# db.py calls in one transaction() makes them a single unit of work with one commit.
+@contextmanager
+def transaction():
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        depth = getattr(_local, "depth", 0)
+        deferred = getattr(_local, "deferred", None)
+        _local.depth = depth + 1
+        try:
+            if depth == 0 and deferred is None:
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    yield cursor
+                except BaseException:
+                    cursor.execute("ROLLBACK")
+                    _rolled_back()
+                    raise
+                cursor.execute("COMMIT")
+                _committed()
+            else:
+                if not conn.in_transaction:
+                    cursor.execute("BEGIN IMMEDIATE")  # first write since the last deferred commit
+                cursor.execute("SAVEPOINT nested")
+                try:
+                    yield cursor
+                except BaseException:
+                    cursor.execute("ROLLBACK TO nested")
+                    cursor.execute("RELEASE nested")
+                    _rolled_back()
+                    raise
+                cursor.execute("RELEASE nested")
+                if depth == 0:
+                    deferred.wrote()
+        finally:
+            _local.depth = depth
+            cursor.close()
+
+class DeferredCommit:
+    # State of a deferred_commits() block: writes since the last commit and when the first of them ran
+    def __init__(self, conn, max_writes, max_delay):
+        self.conn = conn
+        self.max_writes = max_writes
+        self.max_delay = max_delay
+        self.pending = 0
+        self.first_write = None
+        self.commits = 0
+
+    def wrote(self):
+        self.pending += 1
+        if self.first_write is None:
+            self.first_write = time.monotonic()
+        if self.pending >= self.max_writes or time.monotonic() - self.first_write >= self.max_delay:
+            self.flush()
+
+    # Function to commit the pending writes now
+    def flush(self):
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+            _committed()
+            self.commits += 1
+        self.pending = 0
+        self.first_write = None
+
+# Context manager for an opt-in deferred-commit mode on the calling thread. Each write
+# inside the block still succeeds or fails on its own (it runs in a savepoint), but the
+# commit is postponed until max_writes writes have piled up or max_delay seconds have
+# passed since the first of them, and everything pending is committed when the block
+# exits. The thresholds are checked as writes happen, so the write lock stays held
+# until the next write or the end of the block: wrap it tightly around the write loop.
+# Other connections do not see the writes until they are committed.
+@contextmanager
+def deferred_commits(max_writes=1000, max_delay=1.0):
+    existing = getattr(_local, "deferred", None)
+    if existing is not None:
+        yield existing
+        return
+    with get_pool().connection() as conn:
+        state = DeferredCommit(conn, max_writes, max_delay)
+        _local.deferred = state
+        try:
+            yield state
+            state.flush()
+        except BaseException:
+            # the writes that completed are kept, as they would have been without deferral
+            state.flush()
+            raise
+        finally:
+            _local.deferred = None
+
+# Function to close the pooled connections, e.g. when the program exits. A later
+# call opens the database again.
+def close():
+    global pool
+    with _pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
+    invalidate_caches()
 
 # Function to insert a new category into the Categories table
+@timed
 def insert_category(category_name):
     try:
-        # Check for an existing category with the same name, ignoring capitalization
-        cursor.execute("SELECT category_name FROM Categories WHERE lower(category_name) = lower(?)", (category_name,))
-        existing_category = cursor.fetchone()
-        
-        if existing_category:
-            existing_categories = get_categories()
-            categories_list = [c[1] for c in existing_categories]
-            return f"Category '{category_name}' already exists. Current categories: {', '.join(categories_list)}"
+        with transaction() as cursor:
+            # Check for an existing category with the same name, ignoring capitalization
+            cursor.execute("SELECT category_name FROM Categories WHERE category_name = ? COLLATE NOCASE", (category_name,))
+            existing_category = cursor.fetchone()
 
-        cursor.execute("INSERT INTO Categories (category_name) VALUES (?)", (category_name,))
-        conn.commit()
-        return cursor.lastrowid  # Return the ID of the newly inserted category
+            if existing_category:
+                existing_categories = get_categories()
+                categories_list = [c.name for c in existing_categories]
+                return f"Category '{category_name}' already exists. Current categories: {', '.join(categories_list)}"
+
+            cursor.execute("INSERT INTO Categories (category_name) VALUES (?)", (category_name,))
+            _cache_changed(category_cache)
+            return cursor.lastrowid  # Return the ID of the newly inserted category
     except sqlite3.Error as e:
-        print(f"Error inserting category: {e}")
+        logger.error("Error inserting category: %s", e)
         return None
 
 # Function to update the title of a book
+@timed
 def update_book_title(book_id, new_title):
     try:
-        cursor.execute("UPDATE Books SET title = ? WHERE book_id = ?", (new_title, book_id))
-        conn.commit()
+        with transaction() as cursor:
+            cursor.execute("UPDATE Books SET title = ? WHERE book_id = ?", (new_title, book_id))
+            fuzzy.index_title(cursor, book_id, new_title, replace=True)
     except sqlite3.Error as e:
-        print(f"Error updating book title: {e}")
+        logger.error("Error updating book title: %s", e)
 
-# Function to delete a review by review ID
+# Function to delete a review by review ID. Returns True if the review existed.
+@timed
 def delete_review(review_id):
     try:
-        cursor.execute("DELETE FROM Reviews WHERE review_id = ?", (review_id,))
-        conn.commit()
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM Reviews WHERE review_id = ?", (review_id,))
+            return cursor.rowcount > 0
     except sqlite3.Error as e:
-        print(f"Error deleting review: {e}")
+        logger.error("Error deleting review: %s", e)
+        return False
 
-# Function to retrieve books by a specific author's name
+# Function to retrieve books by a specific author's name. Spelling variants with the same
+# fuzzy.name_key() ("J.R.R. Tolkien", "Jrr Tolkien") match too.
+@timed
 def get_books_by_author(author_name):
     try:
-        cursor.execute("SELECT * FROM Books WHERE author_id IN (SELECT author_id FROM Authors WHERE author_name = ?)", (author_name,))
-        books = cursor.fetchall()
+        with reading(_records(Book)) as cursor:
+            cursor.execute("SELECT * FROM Books WHERE author_id IN (SELECT author_id FROM Authors WHERE name_key = ?)",
+                           (fuzzy.name_key(author_name),))
+            books = cursor.fetchall()
         return books
     except sqlite3.Error as e:
-        print(f"Error retrieving books by author: {e}")
+        logger.error("Error retrieving books by author: %s", e)
         return []
 
-# Function to add a new book
-def add_book(title, author_name, category_id):
+# Function to find an author by name; a spelling variant (same fuzzy.name_key()) finds them
+# too. Returns an Author record with the name as stored, or None for an unknown author.
+@timed
+def find_author(author_name):
     try:
-        # Check if the book with the same title, author name, and category already exists
-        cursor.execute("SELECT book_id FROM Books WHERE title = ? AND author_id IN (SELECT author_id FROM Authors WHERE author_name = ?) AND category_id = ?",
-                       (title, author_name, category_id))
-        existing_book = cursor.fetchone()
+        with reading() as cursor:
+            author_id = _find_author_id(cursor, author_name, confirm=True)
+            if author_id is None:
+                return None
+            cursor.execute("SELECT author_name FROM Authors WHERE author_id = ?", (author_id,))
+            return Author(author_id, cursor.fetchone()[0])
+    except sqlite3.Error as e:
+        logger.error("Error finding author: %s", e)
+        return None
+
+# Looks up an author's ID by name, through the author cache. A spelling variant of an
+# existing author (same fuzzy.name_key()) finds that author. Returns None for an unknown author.
+# A cached ID is returned without reading the database, unless confirm is set: another
+# process (compact.py, dedupe.py) may have deleted or merged the author since it was
+# cached. Writes that store the ID go through _writing_authors(), where the foreign key
+# catches that.
+def _find_author_id(cursor, author_name, confirm=False):
+    author_id = author_cache.get(author_name)
+    if author_id is not None and not confirm:
+        return author_id
+    key = fuzzy.name_key(author_name)
+    # nothing left after normalizing (only punctuation), so only the exact name matches
+    column, value = ("name_key", key) if key else ("author_name", author_name)
+    if author_id is not None:
+        cursor.execute(f"SELECT 1 FROM Authors WHERE author_id = ? AND {column} = ?", (author_id, value))
+        if cursor.fetchone() is not None:
+            return author_id
+        author_cache.invalidate(author_name)
 
-        if existing_book:
-            return -1  # Return a negative value to indicate an error
+    cursor.execute(f"SELECT author_id FROM Authors WHERE {column} = ? ORDER BY author_id LIMIT 1", (value,))
+    existing_author = cursor.fetchone()
+    if existing_author is None:
+        return None
+    author_id = existing_author[0]
+    _cache_author(author_name, author_id)
+    return author_id
+
+# Function to run write(cursor) in a transaction and return its result, for writes that
+# store author IDs from _find_author_id(). If one of them belongs to an author another
+# process has deleted since it was cached, the foreign key refuses the write, the rollback
+# drops the caches, and the write runs once more with IDs read from the database. SQLite
+# gives a new author the ID of a deleted one if it was the highest ID, which the foreign
+# key cannot catch: _insert_author() drops the cache when it sees that happen, but not
+# when another process inserted the new author.
+def _writing_authors(write):
+    try:
+        with transaction() as cursor:
+            return write(cursor)
+    except sqlite3.IntegrityError as e:
+        if "FOREIGN KEY" not in str(e):
+            raise
+    with transaction() as cursor:
+        return write(cursor)
 
-        # Check if the author with the same name already exists
-        cursor.execute("SELECT author_id FROM Authors WHERE author_name = ?", (author_name,))
-        existing_author = cursor.fetchone()
+# highest author ID put in author_cache since it was last dropped
+_highest_cached_author = 0
 
-        if existing_author:
-            author_id = existing_author[0]  # Use the existing author's ID
+def _cache_author(author_name, author_id):
+    global _highest_cached_author
+    author_cache.put(author_name, author_id)
+    _highest_cached_author = max(_highest_cached_author, author_id)
+
+# Inserts a new author, adds them to the fuzzy index and caches their ID. A new ID no
+# higher than one already cached was freed by deleting an author, who may still be cached.
+def _insert_author(cursor, author_name):
+    global _highest_cached_author
+    cursor.execute("INSERT INTO Authors (author_name) VALUES (?)", (author_name,))
+    author_id = cursor.lastrowid
+    fuzzy.index_author(cursor, author_id, author_name)
+    if author_id <= _highest_cached_author:
+        author_cache.invalidate()
+        _highest_cached_author = 0
+    _cache_author(author_name, author_id)
+    return author_id
+
+# Looks up an author by name and inserts them if they are new, returning the author ID
+def _get_or_create_author(cursor, author_name):
+    author_id = _find_author_id(cursor, author_name)
+    if author_id is not None:
+        return author_id  # Use the existing author's ID
+
+    # Author does not exist, insert the new author
+    return _insert_author(cursor, author_name)
+
+# Function to add a new book
+@timed
+def add_book(title, author_name, category_id):
+    def write(cursor):
+        author_id = _find_author_id(cursor, author_name)
+
+        if author_id is not None:
+            # Check if the book with the same title, author, and category already exists
+            cursor.execute("SELECT book_id FROM Books WHERE title = ? AND author_id = ? AND category_id = ?",
+                           (title, author_id, category_id))
+            existing_book = cursor.fetchone()
+
+            if existing_book:
+                return -1  # Return a negative value to indicate an error
         else:
-            # Author does not exist, insert the new author
-            cursor.execute("INSERT INTO Authors (author_name) VALUES (?)", (author_name,))
-            conn.commit()
-            author_id = cursor.lastrowid  # Retrieve the ID of the newly inserted author
+            # a new author cannot have written this book yet
+            author_id = _insert_author(cursor, author_name)
 
         cursor.execute("INSERT INTO Books (title, author_id, category_id) VALUES (?, ?, ?)",
                        (title, author_id, category_id))
-        conn.commit()
-        return cursor.lastrowid  # Return the ID of the newly inserted book
+        book_id = cursor.lastrowid
+        fuzzy.index_title(cursor, book_id, title)
+        return book_id  # Return the ID of the newly inserted book
+
+    try:
+        return _writing_authors(write)
     except sqlite3.Error as e:
-        print(f"Error adding book: {e}")
+        logger.error("Error adding book: %s", e)
         return -1  # Return a negative value to indicate an error
 
 # Function to add a new author
+@timed
 def add_author(author_name):
-    # Check if the author with the same name already exists
-    cursor.execute("SELECT author_id FROM Authors WHERE author_name = ?", (author_name,))
-    existing_author = cursor.fetchone()
-
-    if existing_author:
-        print("Error: Author with the same name already exists.")
-        return "Author with the same name already exists."
-
     try:
-        cursor.execute("INSERT INTO Authors (author_name) VALUES (?)", (author_name,))
-        conn.commit()
-        return cursor.lastrowid  # Return the ID of the newly inserted author
+        with transaction() as cursor:
+            # Check if the author with the same name (or a spelling variant of it) already exists
+            if _find_author_id(cursor, author_name, confirm=True) is not None:
+                logger.error("Error: Author with the same name already exists.")
+                return "Author with the same name already exists."
+
+            return _insert_author(cursor, author_name)  # Return the ID of the newly inserted author
     except sqlite3.Error as e:
-        print(f"Error adding author: {e}")
+        logger.error("Error adding author: %s", e)
         return None
 
 # Function to add a new review
+@timed
 def add_review(book_id, user_id, rating, review_text):
     try:
-        cursor.execute("INSERT INTO Reviews (book_id, user_id, rating, review_text) VALUES (?, ?, ?, ?)",
-                       (book_id, user_id, rating, review_text))
-        conn.commit()
-        return cursor.lastrowid  # Return the ID of the newly inserted review
+        with transaction() as cursor:
+            cursor.execute("INSERT INTO Reviews (book_id, user_id, rating, review_text) VALUES (?, ?, ?, ?)",
+                           (book_id, user_id, rating, review_text))
+            return cursor.lastrowid  # Return the ID of the newly inserted review
     except sqlite3.Error as e:
-        print(f"Error adding review: {e}")
+        logger.error("Error adding review: %s", e)
         return None
-    
+
+def _load_categories():
+    with reading(_records(Category)) as cursor:
+        cursor.execute("SELECT * FROM Categories")
+        return tuple(cursor.fetchall())
+
 # Function to retrieve all categories
+@timed
 def get_categories():
-    cursor.execute("SELECT * FROM Categories")
-    categories = cursor.fetchall()
-    return categories
-
-# Function to retrieve all books with details (including category name)
-def get_all_books(category_id=None):
-    if category_id is not None:
-        cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
-                        FROM Books
-                        LEFT JOIN Authors ON Books.author_id = Authors.author_id
-                        LEFT JOIN Categories ON Books.category_id = Categories.category_id
-                        LEFT JOIN Reviews ON Books.book_id = Reviews.book_id
-                        WHERE Books.category_id = ?''', (category_id,))
-    else:
-        cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
-                        FROM Books
-                        LEFT JOIN Authors ON Books.author_id = Authors.author_id
-                        LEFT JOIN Categories ON Books.category_id = Categories.category_id
-                        LEFT JOIN Reviews ON Books.book_id = Reviews.book_id''')
-    books = cursor.fetchall()
+    categories = category_cache.get_or_load("categories", _load_categories)
+    return list(categories)
+
+# Function to retrieve the set of valid category IDs, for validating input
+@timed
+def get_category_ids():
+    return category_cache.get_or_load("ids", lambda: frozenset(category.id for category in get_categories()))
+
+# Function to retrieve all books with details (including category name), one BookListing
+# per review. With raw=True the rows are plain tuples in the same field order, which
+# skips building an object per row for bulk scans; either way equal strings are shared
+# between rows.
+@timed
+def get_all_books(category_id=None, raw=False):
+    with reading(_listing_records(raw)) as cursor:
+        if category_id is not None:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN Reviews ON Books.book_id = Reviews.book_id
+                            WHERE Books.category_id = ?''', (category_id,))
+        else:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN Reviews ON Books.book_id = Reviews.book_id''')
+        books = cursor.fetchall()
     return books
 
+# number of books per page when listing the catalog
+BOOK_PAGE_SIZE = 50
+
+# Function to retrieve one page of books (with their reviews) after a given book ID.
+# The books are picked first, by primary key, so a page never splits a book's reviews
+# and the cost of a page does not depend on how far into the catalog it is.
+# Rows are BookListing records, or plain tuples with raw=True.
+@timed
+def get_books_page(after_book_id=0, limit=BOOK_PAGE_SIZE, category_id=None, raw=False):
+    with reading(_listing_records(raw)) as cursor:
+        if category_id is not None:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
+                            FROM (SELECT * FROM Books WHERE category_id = ? AND book_id > ? ORDER BY book_id LIMIT ?) AS Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN Reviews ON Books.book_id = Reviews.book_id
+                            ORDER BY Books.book_id, Reviews.review_id''', (category_id, after_book_id, limit))
+        else:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
+                            FROM (SELECT * FROM Books WHERE book_id > ? ORDER BY book_id LIMIT ?) AS Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN Reviews ON Books.book_id = Reviews.book_id
+                            ORDER BY Books.book_id, Reviews.review_id''', (after_book_id, limit))
+        return cursor.fetchall()
+
+# Generator that walks the catalog one page at a time, yielding each page as a list of rows
+def iter_book_pages(category_id=None, page_size=BOOK_PAGE_SIZE, raw=False):
+    after_book_id = 0
+    while True:
+        page = get_books_page(after_book_id, page_size, category_id, raw)
+        if not page:
+            return
+        yield page
+        # the next page starts after the last book of this one
+        after_book_id = page[-1][0] if raw else page[-1].id
+
+# Generator with the same rows as get_all_books, holding only one page in memory at a time
+def iter_books(category_id=None, page_size=BOOK_PAGE_SIZE, raw=False):
+    for page in iter_book_pages(category_id, page_size, raw):
+        yield from page
+
+# Fields of a BookSummary, and the names of the lists get_book_summaries(columnar=True) returns
+BOOK_SUMMARY_COLUMNS = ("id", "title", "author_name", "category_name", "review_count", "avg_rating")
+
+# Function to retrieve one page of the grouped listing: one BookSummary per book, with the
+# review count and average rating read from BookStats instead of one row per review.
+# Pages are picked by primary key, as in get_books_page.
+@timed
+def get_book_summaries_page(after_book_id=0, limit=BOOK_PAGE_SIZE, category_id=None):
+    with reading(_records(BookSummary)) as cursor:
+        if category_id is not None:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name,
+                                   COALESCE(BookStats.review_count, 0), BookStats.avg_rating
+                            FROM (SELECT * FROM Books WHERE category_id = ? AND book_id > ? ORDER BY book_id LIMIT ?) AS Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                            ORDER BY Books.book_id''', (category_id, after_book_id, limit))
+        else:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name,
+                                   COALESCE(BookStats.review_count, 0), BookStats.avg_rating
+                            FROM (SELECT * FROM Books WHERE book_id > ? ORDER BY book_id LIMIT ?) AS Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                            ORDER BY Books.book_id''', (after_book_id, limit))
+        return cursor.fetchall()
+
+# Generator that walks the grouped listing one page of BookSummary records at a time
+def iter_book_summary_pages(category_id=None, page_size=BOOK_PAGE_SIZE):
+    after_book_id = 0
+    while True:
+        page = get_book_summaries_page(after_book_id, page_size, category_id)
+        if not page:
+            return
+        yield page
+        after_book_id = page[-1].id
+
+# Function to retrieve the grouped listing of the whole catalog (or one category) at once.
+# With columnar=True it returns a dict with one list per field of BookSummary instead of
+# a list of records, e.g. {"id": [...], "title": [...], ...}, for reports and exports.
+@timed
+def get_book_summaries(category_id=None, columnar=False):
+    with reading(None if columnar else _records(BookSummary)) as cursor:
+        if category_id is not None:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name,
+                                   COALESCE(BookStats.review_count, 0), BookStats.avg_rating
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                            WHERE Books.category_id = ?
+                            ORDER BY Books.book_id''', (category_id,))
+        else:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name,
+                                   COALESCE(BookStats.review_count, 0), BookStats.avg_rating
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                            ORDER BY Books.book_id''')
+        if not columnar:
+            return cursor.fetchall()
+
+        # transpose a chunk of rows at a time, so the full list of rows never exists
+        columns = [[] for _ in BOOK_SUMMARY_COLUMNS]
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+        return dict(zip(BOOK_SUMMARY_COLUMNS, columns))
+
+# Function to retrieve the n most recent reviews of a book, newest first
+@timed
+def get_recent_reviews(book_id, n=3):
+    try:
+        with reading(_records(Review)) as cursor:
+            cursor.execute("SELECT * FROM Reviews WHERE book_id = ? ORDER BY review_id DESC LIMIT ?", (book_id, n))
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error retrieving reviews: %s", e)
+        return []
+
 # def get_all_books():
 #     cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name, Reviews.rating, Reviews.review_text
 #                     FROM Books
@@ -174,51 +605,362 @@ def get_all_books(category_id=None):
 #     books = cursor.fetchall()
 #     return books
 
+@timed
 def delete_book(book_id):
     try:
-        cursor.execute("DELETE FROM Books WHERE book_id = ?", (book_id,))
-        conn.commit()
-        return True
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM Books WHERE book_id = ?", (book_id,))
+            return True
     except sqlite3.Error as e:
-        print(f"Error deleting book: {e}")
+        logger.error("Error deleting book: %s", e)
         return False
-    
+
+# Function to delete many books in one transaction. Their reviews go with them (ON DELETE
+# CASCADE), and authors or categories left without books are queued for compact.py.
+# Returns the number of books deleted, or -1 if nothing was deleted because of an error.
+@timed
+def delete_books(book_ids):
+    try:
+        with transaction() as cursor:
+            cursor.executemany("DELETE FROM Books WHERE book_id = ?", ((book_id,) for book_id in book_ids))
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error("Error deleting books: %s", e)
+        return -1
+
+@timed
 def get_review_by_id(review_id):
     try:
-        cursor.execute("SELECT * FROM Reviews WHERE review_id = ?", (review_id,))
-        review = cursor.fetchone()
-        return review
+        with reading(_records(Review)) as cursor:
+            cursor.execute("SELECT * FROM Reviews WHERE review_id = ?", (review_id,))
+            review = cursor.fetchone()
+            return review
+    except sqlite3.Error as e:
+        logger.error("Error retrieving review: %s", e)
+        return None
+
+# Function to retrieve a single book (ID, title, author name, category name) by its ID
+@timed
+def get_book_by_id(book_id):
+    try:
+        with reading(_records(BookDetails)) as cursor:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            WHERE Books.book_id = ?''', (book_id,))
+            return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error retrieving book: %s", e)
+        return None
+
+# Smallest string that sorts after every string starting with the prefix. NOCASE only
+# folds ASCII letters to lower case, so the last character is folded the same way.
+def _prefix_upper_bound(prefix, case_insensitive):
+    last = prefix[-1]
+    if case_insensitive and 'A' <= last <= 'Z':
+        last = last.lower()
+    return prefix[:-1] + chr(ord(last) + 1)
+
+# Function to find books by title, optionally ignoring case and/or matching the start of the title.
+# Prefix matches are written as a range on the title so they can use the title indexes.
+@timed
+def find_books_by_title(title, case_insensitive=False, prefix=False):
+    if not title:
+        return []
+    collate = " COLLATE NOCASE" if case_insensitive else ""
+    if prefix:
+        where = f"Books.title >= ?{collate} AND Books.title < ?{collate}"
+        params = (title, _prefix_upper_bound(title, case_insensitive))
+    else:
+        where = f"Books.title = ?{collate}"
+        params = (title,)
+    try:
+        with reading(_records(BookDetails)) as cursor:
+            cursor.execute(f'''SELECT Books.book_id, Books.title, Authors.author_name, Categories.category_name
+                            FROM Books
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            LEFT JOIN Categories ON Books.category_id = Categories.category_id
+                            WHERE {where}
+                            ORDER BY Books.title, Books.book_id''', params)
+            return cursor.fetchall()
     except sqlite3.Error as e:
-        print(f"Error retrieving review: {e}")
+        logger.error("Error finding books by title: %s", e)
+        return []
+
+# Turns what a patron typed into an FTS5 query: every word must appear, and the last
+# word may be unfinished. Words are quoted so FTS5 operators in the input are ignored.
+def _search_expression(query):
+    words = re.findall(r"\w+", query)
+    if not words:
         return None
-    
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+# Function to search titles, author names and review text, best matches first.
+# Returns SearchResult records; matches in the snippet are wrapped in [ ].
+@timed
+def search_books(query, limit=20):
+    expression = _search_expression(query)
+    if expression is None:
+        return []
+    try:
+        with reading() as cursor:
+            # A book has one row for its title and author plus one row per review, so take
+            # the best rows and keep each book's best one until limit books are found. Sorting
+            # with a LIMIT is much cheaper than sorting every match, so fetch a few rows per
+            # book and only go back for more when too many of them belong to the same books.
+            # bm25 weights: a hit in the title counts most, then the author, then the reviews
+            fetch = limit * 4
+            while True:
+                cursor.execute('''SELECT rowid, book_id FROM BookSearch
+                                WHERE BookSearch MATCH ?
+                                ORDER BY bm25(BookSearch, 10.0, 5.0, 1.0)
+                                LIMIT ?''', (expression, fetch))
+                rows = cursor.fetchall()
+                best_rows = {}
+                for rowid, book_id in rows:
+                    if book_id not in best_rows:
+                        best_rows[book_id] = rowid
+                        if len(best_rows) >= limit:
+                            break
+                if len(best_rows) >= limit or len(rows) < fetch:
+                    break
+                fetch *= 4
+            if not best_rows:
+                return []
+
+            # snippets are costly, so only build them for the rows that made the cut
+            placeholders = ", ".join("?" * len(best_rows))
+            cursor.execute(f'''SELECT rowid, snippet(BookSearch, -1, '[', ']', '...', 12) FROM BookSearch
+                            WHERE BookSearch MATCH ? AND rowid IN ({placeholders})''', (expression, *best_rows.values()))
+            snippets = dict(cursor.fetchall())
+            cursor.execute(f'''SELECT Books.book_id, Books.title, Authors.author_name
+                            FROM Books LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            WHERE Books.book_id IN ({placeholders})''', list(best_rows))
+            books = {book_id: (title, author_name) for book_id, title, author_name in cursor}
+        return [SearchResult(book_id, *books[book_id], snippets.get(rowid))
+                for book_id, rowid in best_rows.items() if book_id in books]
+    except sqlite3.Error as e:
+        logger.error("Error searching books: %s", e)
+        return []
+
+# Function to retrieve the precomputed review stats of a book, or None if it has never
+# been reviewed. A book whose reviews were all deleted keeps its row, with review_count 0
+# and avg_rating None, so its last_review_at is not lost.
+@timed
+def get_book_stats(book_id):
+    try:
+        with reading(_records(BookStats)) as cursor:
+            cursor.execute("SELECT * FROM BookStats WHERE book_id = ?", (book_id,))
+            return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error("Error retrieving book stats: %s", e)
+        return None
+
+# Function to retrieve the highest rated books, optionally within one category.
+# Returns RatedBook records read from BookStats.
+@timed
+def get_top_rated_books(category_id=None, limit=10, min_reviews=1):
+    try:
+        with reading(_records(RatedBook)) as cursor:
+            if category_id is not None:
+                cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, BookStats.avg_rating, BookStats.review_count
+                                FROM Books
+                                JOIN BookStats ON Books.book_id = BookStats.book_id
+                                LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                                WHERE Books.category_id = ? AND BookStats.review_count >= ?
+                                ORDER BY BookStats.avg_rating DESC, BookStats.review_count DESC
+                                LIMIT ?''', (category_id, min_reviews, limit))
+            else:
+                cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, BookStats.avg_rating, BookStats.review_count
+                                FROM BookStats
+                                JOIN Books ON Books.book_id = BookStats.book_id
+                                LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                                WHERE BookStats.review_count >= ?
+                                ORDER BY BookStats.avg_rating DESC, BookStats.review_count DESC
+                                LIMIT ?''', (min_reviews, limit))
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error retrieving top rated books: %s", e)
+        return []
+
+# Function to retrieve the books most often liked by the readers of a book, best first.
+# They are precomputed by recommend.py, so this is a primary key lookup in BookNeighbors.
+@timed
+def get_recommendations(book_id, limit=10):
+    try:
+        with reading(_records(Recommendation)) as cursor:
+            cursor.execute('''SELECT Books.book_id, Books.title, Authors.author_name, BookNeighbors.score
+                            FROM BookNeighbors
+                            JOIN Books ON Books.book_id = BookNeighbors.neighbor_id
+                            LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                            WHERE BookNeighbors.book_id = ?
+                            ORDER BY BookNeighbors.rank
+                            LIMIT ?''', (book_id, limit))
+            return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error("Error retrieving recommendations: %s", e)
+        return []
+
 # Function to update the author of a book
+@timed
 def update_book_author(book_id, new_author_name):
+    def write(cursor):
+        author_id = _get_or_create_author(cursor, new_author_name)
+        cursor.execute("UPDATE Books SET author_id = ? WHERE book_id = ?", (author_id, book_id))
+
     try:
-        # Check if the author with the same name already exists
-        cursor.execute("SELECT author_id FROM Authors WHERE author_name = ?", (new_author_name,))
-        existing_author = cursor.fetchone()
+        _writing_authors(write)
+    except sqlite3.Error as e:
+        logger.error("Error updating book author: %s", e)
 
-        if existing_author:
-            author_id = existing_author[0]  # Use the existing author's ID
-        else:
-            # Author does not exist, insert the new author
-            cursor.execute("INSERT INTO Authors (author_name) VALUES (?)", (new_author_name,))
-            conn.commit()
-            author_id = cursor.lastrowid  # Retrieve the ID of the newly inserted author
+# Function to change several fields of a book at once, in one UPDATE and one commit.
+# Fields left as None are not changed. Returns True if the book was updated.
+@timed
+def update_book(book_id, title=None, author_name=None, category_id=None):
+    def write(cursor):
+        fields = {}
+        if title is not None:
+            fields["title"] = title
+        if author_name is not None:
+            fields["author_id"] = _get_or_create_author(cursor, author_name)
+        if category_id is not None:
+            fields["category_id"] = category_id
+        if not fields:
+            return False
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        cursor.execute(f"UPDATE Books SET {assignments} WHERE book_id = ?", (*fields.values(), book_id))
+        if cursor.rowcount == 0:
+            return False
+        if title is not None:
+            fuzzy.index_title(cursor, book_id, title, replace=True)
+        return True
 
-        cursor.execute("UPDATE Books SET author_id = ? WHERE book_id = ?", (author_id, book_id))
-        conn.commit()
+    try:
+        return _writing_authors(write)
     except sqlite3.Error as e:
-        print(f"Error updating book author: {e}")
+        logger.error("Error updating book: %s", e)
+        return False
 
 # Function to update the category of a book
+@timed
 def update_book_category(book_id, new_category_id):
     try:
-        cursor.execute("UPDATE Books SET category_id = ? WHERE book_id = ?", (new_category_id, book_id))
-        conn.commit()
+        with transaction() as cursor:
+            cursor.execute("UPDATE Books SET category_id = ? WHERE book_id = ?", (new_category_id, book_id))
+    except sqlite3.Error as e:
+        logger.error("Error updating book category: %s", e)
+
+
+# Function to suggest authors whose names look like author_name ("did you mean"), best
+# first, from the typo index of fuzzy.py. Returns AuthorMatch records.
+@timed
+def suggest_authors(author_name, limit=5, threshold=fuzzy.DEFAULT_THRESHOLD):
+    try:
+        with reading() as cursor:
+            matches = fuzzy.lookup(cursor, "author", author_name, limit, threshold)
+        return [AuthorMatch(author_id, name, score) for score, author_id, name in matches]
     except sqlite3.Error as e:
-        print(f"Error updating book category: {e}")
+        logger.error("Error suggesting authors: %s", e)
+        return []
 
-conn.commit()
-# conn.close()
+# Function to suggest books whose titles look like title, best first. Returns TitleMatch records.
+@timed
+def suggest_titles(title, limit=5, threshold=fuzzy.DEFAULT_THRESHOLD):
+    try:
+        with reading() as cursor:
+            matches = fuzzy.lookup(cursor, "title", title, limit, threshold)
+            if not matches:
+                return []
+            cursor.execute(f'''SELECT Books.book_id, Authors.author_name FROM Books
+                             LEFT JOIN Authors ON Books.author_id = Authors.author_id
+                             WHERE Books.book_id IN ({', '.join('?' * len(matches))})''',
+                           [book_id for _, book_id, _ in matches])
+            authors = dict(cursor.fetchall())
+        return [TitleMatch(book_id, book_title, authors.get(book_id), score) for score, book_id, book_title in matches]
+    except sqlite3.Error as e:
+        logger.error("Error suggesting titles: %s", e)
+        return []
+
+# Function to find likely duplicate authors: groups of authors with the same name_key and,
+# if threshold is given, pairs of other authors whose names are at least that similar.
+# Returns a list of groups, each a list of Author records with the oldest author first.
+@timed
+def find_duplicate_authors(threshold=None):
+    try:
+        with reading() as cursor:
+            cursor.execute('''SELECT author_id, author_name, name_key FROM Authors
+                            WHERE name_key IN (SELECT name_key FROM Authors WHERE name_key != ''
+                                               GROUP BY name_key HAVING COUNT(*) > 1)
+                            ORDER BY name_key, author_id''')
+            groups = {}
+            for author_id, author_name, key in cursor.fetchall():
+                groups.setdefault(key, []).append(Author(author_id, author_name))
+            duplicates = list(groups.values())
+            if threshold is None:
+                return duplicates
+
+            grouped = {author.id for group in duplicates for author in group}
+            cursor.execute("SELECT author_id, author_name FROM Authors")
+            names = dict(cursor.fetchall())  # fetched up front: lookup() reuses the cursor
+            for author_id, author_name in names.items():
+                for _, other_id, other_name in fuzzy.lookup(cursor, "author", author_name, limit=10, threshold=threshold):
+                    if other_id > author_id and other_id not in grouped:
+                        duplicates.append([Author(author_id, author_name), Author(other_id, other_name)])
+        return duplicates
+    except sqlite3.Error as e:
+        logger.error("Error finding duplicate authors: %s", e)
+        return []
+
+# Function to merge duplicate authors into one: their books move to keep_author_id and
+# the duplicates are deleted. Returns the number of books moved, or -1 on error.
+@timed
+def merge_authors(keep_author_id, duplicate_author_ids):
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT 1 FROM Authors WHERE author_id = ?", (keep_author_id,))
+            if cursor.fetchone() is None:
+                logger.error("Error merging authors: no author with ID %s", keep_author_id)
+                return -1
+            moved = 0
+            for author_id in duplicate_author_ids:
+                if author_id == keep_author_id:
+                    continue
+                cursor.execute("UPDATE Books SET author_id = ? WHERE author_id = ?", (keep_author_id, author_id))
+                moved += cursor.rowcount
+                cursor.execute("DELETE FROM Authors WHERE author_id = ?", (author_id,))
+            # names of the deleted authors are cached with their old IDs
+            _cache_changed(author_cache)
+            return moved
+    except sqlite3.Error as e:
+        logger.error("Error merging authors: %s", e)
+        return -1
+
+# Function to change an author's name, for all of their books, e.g. to fix its spelling
+# ("Jrr Tolkien" to "J.R.R. Tolkien"); the new name is re-indexed for fuzzy lookups. A name
+# that another author already has (same name_key) is refused: merge_authors() joins them.
+# Returns True if the author was renamed.
+@timed
+def rename_author(author_id, new_name):
+    try:
+        with transaction() as cursor:
+            key = fuzzy.name_key(new_name)
+            if key:
+                cursor.execute("SELECT author_id FROM Authors WHERE name_key = ? AND author_id != ? LIMIT 1",
+                               (key, author_id))
+                other = cursor.fetchone()
+                if other is not None:
+                    logger.error("Error renaming author: '%s' is author %s already, merge them instead", new_name, other[0])
+                    return False
+            cursor.execute("UPDATE Authors SET author_name = ? WHERE author_id = ?", (new_name, author_id))
+            if cursor.rowcount == 0:
+                return False
+            fuzzy.index_author(cursor, author_id, new_name, replace=True)
+            # the old name is cached with this author's ID
+            _cache_changed(author_cache)
+            return True
+    except sqlite3.Error as e:
+        logger.error("Error renaming author: %s", e)
+        return False
@@ -0,0 +1,70 @@
+import sys
+
+import db
+
+# Finding and merging duplicate authors.
+#
+#     python dedupe.py find                  authors with the same normalized name
+#     python dedupe.py find --similar 0.6    ...and pairs of names at least that similar
+#     python dedupe.py merge 12 40 41        moves the books of authors 40 and 41 to 12
+#     python dedupe.py merge --all           merges every same-name group into its oldest author
+#     python dedupe.py rename 12 "J.R.R. Tolkien"   fixes the spelling of author 12's name
+#     python dedupe.py suggest "Tolkein"     "did you mean" for an author name
+#
+# New spelling variants are caught as they are added (see fuzzy.name_key()); this is
+# for the ones already in the database, and for near misses that need a human to decide.
+
+def _print_groups(groups):
+    for group in groups:
+        print(", ".join(f"{author.id}: {author.name}" for author in group))
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find and merge duplicate authors.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find_parser = commands.add_parser("find", help="list likely duplicate authors")
+    find_parser.add_argument("--similar", type=float, metavar="THRESHOLD",
+                             help="also list pairs of names at least this similar (0-1)")
+    merge_parser = commands.add_parser("merge", help="merge authors into the first one given")
+    merge_parser.add_argument("author_ids", type=int, nargs="*", help="the author to keep, then the duplicates")
+    merge_parser.add_argument("--all", action="store_true", help="merge every group of authors with the same normalized name")
+    rename_parser = commands.add_parser("rename", help="change the name of an author")
+    rename_parser.add_argument("author_id", type=int)
+    rename_parser.add_argument("name")
+    suggest_parser = commands.add_parser("suggest", help="show authors whose names look like NAME")
+    suggest_parser.add_argument("name")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "find":
+            groups = db.find_duplicate_authors(args.similar)
+            _print_groups(groups)
+            print(f"{len(groups)} groups of likely duplicates.")
+        elif args.command == "merge":
+            if args.all:
+                groups = [[author.id for author in group] for group in db.find_duplicate_authors()]
+            elif len(args.author_ids) >= 2:
+                groups = [args.author_ids]
+            else:
+                merge_parser.error("give the author to keep and at least one duplicate, or --all")
+            for keep, *duplicates in groups:
+                moved = db.merge_authors(keep, duplicates)
+                if moved < 0:
+                    print(f"Error: Failed to merge authors {duplicates} into {keep}.")
+                    return 1
+                print(f"Merged {len(duplicates)} authors into {keep}, {moved} books moved.")
+        elif args.command == "rename":
+            if not db.rename_author(args.author_id, args.name):
+                print(f"Error: Failed to rename author {args.author_id}.")
+                return 1
+            print(f"Renamed author {args.author_id} to {args.name}.")
+        else:
+            for match in db.suggest_authors(args.name):
+                print(f"{match.score:.2f}  Author ID: {match.id}, Name: {match.name}")
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
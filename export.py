@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import db
+
+# Nightly exports and online backups of the library database.
+#
+#     python export.py export exports/ --format jsonl
+#     python export.py backup backups/library-2024-01-01.db
+#
+# Both read through a pooled connection. In WAL mode readers never block writers, so
+# the application keeps running while they work.
+
+# rows fetched from SQLite and written out at a time, so memory use does not depend on table size
+DEFAULT_CHUNK_SIZE = 5000
+# pages copied per backup step, and the pause between steps that lets other connections in
+DEFAULT_BACKUP_PAGES = 1024
+DEFAULT_BACKUP_SLEEP = 0.005
+
+# Exported tables: file name, query and (column, type) pairs. The types are used for Parquet.
+EXPORT_TABLES = {
+    "categories": ("SELECT category_id, category_name FROM Categories ORDER BY category_id",
+                   [("category_id", "int64"), ("category_name", "string")]),
+    "authors": ("SELECT author_id, author_name FROM Authors ORDER BY author_id",
+                [("author_id", "int64"), ("author_name", "string")]),
+    "books": ("SELECT book_id, title, author_id, category_id FROM Books ORDER BY book_id",
+              [("book_id", "int64"), ("title", "string"), ("author_id", "int64"), ("category_id", "int64")]),
+    "reviews": ("SELECT review_id, book_id, user_id, rating, review_text FROM Reviews ORDER BY review_id",
+                [("review_id", "int64"), ("book_id", "int64"), ("user_id", "int64"), ("rating", "float64"),
+                 ("review_text", "string")]),
+}
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+def _chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+def _write_csv(cursor, columns, path, chunk_size):
+    rows_written = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in _chunks(cursor, chunk_size):
+            writer.writerows(rows)
+            rows_written += len(rows)
+    return rows_written
+
+def _write_jsonl(cursor, columns, path, chunk_size):
+    names = [name for name, _ in columns]
+    rows_written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for rows in _chunks(cursor, chunk_size):
+            f.write("".join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows))
+            rows_written += len(rows)
+    return rows_written
+
+# Each chunk becomes one Parquet row group, so only one chunk is held in memory at a time
+def _write_parquet(cursor, columns, path, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns])
+    rows_written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in _chunks(cursor, chunk_size):
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows_written += len(rows)
+    return rows_written
+
+_WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl, "parquet": _write_parquet}
+
+# Function to export tables (all of them by default) into a directory, one file per table.
+# Everything is read in a single read transaction, so the files agree with each other even
+# while writers keep changing the database. Returns {table: number of rows written}.
+def export_tables(directory, fmt="csv", tables=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    tables = list(EXPORT_TABLES) if tables is None else tables
+    for table in tables:
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    with db.reading() as cursor:
+        own_transaction = not cursor.connection.in_transaction
+        if own_transaction:
+            cursor.execute("BEGIN")
+        try:
+            for table in tables:
+                sql, columns = EXPORT_TABLES[table]
+                path = os.path.join(directory, f"{table}.{fmt}")
+                cursor.execute(sql)
+                # write next to the final file and rename, so a reader never sees half an export
+                counts[table] = _WRITERS[fmt](cursor, columns, path + ".tmp", chunk_size)
+                os.replace(path + ".tmp", path)
+        finally:
+            if own_transaction:
+                cursor.execute("COMMIT")
+    return counts
+
+# Function to copy the live database to path with the SQLite online backup API, a few
+# pages per step with a pause in between. The copy is the database as it was when the
+# snapshot started. progress(remaining, total) is called after each step. Returns the
+# seconds taken.
+def snapshot(path, pages=DEFAULT_BACKUP_PAGES, sleep=DEFAULT_BACKUP_SLEEP, progress=None):
+    start = time.perf_counter()
+    temporary = path + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    target = sqlite3.connect(temporary)
+    try:
+        with db.get_pool().connection() as conn:
+            # Hold one read transaction across all the steps: it pins a WAL snapshot, so
+            # writes committed meanwhile by other connections neither show up in the copy
+            # nor make SQLite restart it, and writers are never blocked
+            conn.execute("BEGIN")
+            try:
+                conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                conn.backup(target, pages=pages, sleep=sleep,
+                            progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None)
+            finally:
+                conn.execute("COMMIT")
+        # the copy is a standalone file, so it does not need the source's write-ahead log
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+    os.replace(temporary, path)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export or back up the library database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write tables to CSV, JSON Lines or Parquet files")
+    export_parser.add_argument("directory", help="directory for the exported files")
+    export_parser.add_argument("--format", choices=FORMATS, default="csv")
+    export_parser.add_argument("--tables", help="comma separated tables (default: all of " + ", ".join(EXPORT_TABLES) + ")")
+    export_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per fetch")
+    backup_parser = commands.add_parser("backup", help="copy the live database to a file")
+    backup_parser.add_argument("path", help="file to write the copy to")
+    backup_parser.add_argument("--pages", type=int, default=DEFAULT_BACKUP_PAGES,
+                               help="pages copied per step (-1 copies everything in one step)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            tables = args.tables.split(",") if args.tables else None
+            start = time.perf_counter()
+            counts = export_tables(args.directory, args.format, tables, args.chunk_size)
+            for table, rows in counts.items():
+                print(f"Exported {rows} rows from {table}.")
+            print(f"Finished in {time.perf_counter() - start:.2f}s.")
+        else:
+            seconds = snapshot(args.path, pages=args.pages)
+            print(f"Backed up the database to {args.path} in {seconds:.2f}s.")
+    except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
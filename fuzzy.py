@@ -0,0 +1,247 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Normalized names and a typo index, for "did you mean" lookups and duplicate authors.
+#
+# name_key() reduces an author name to a canonical form: accents, case, punctuation
+# and word order are ignored and initials are run together, so "J.R.R. Tolkien",
+# "Jrr Tolkien" and "Tolkien, J. R. R." all become "jrr tolkien". db.py treats two
+# authors with the same key as the same author.
+#
+# Names that still differ ("Tolkein") are found through their words. Every word is
+# indexed with each word that deleting one of its letters makes ("tolkien", "olkien", ...
+# "tolkie"), so two words one typo apart (a letter missing, added or changed, or two
+# letters swapped) always have a key in common: "tolkein" and "tolkien" both make
+# "tolken". Words of one or two letters are indexed as they are, and so are all the words
+# of a name or title run together, for a typo that joins two words. AuthorVariants and
+# TitleVariants map each key to the authors or books that have it, and
+# AuthorVariantCounts and TitleVariantCounts say how many. A lookup reads the keys of the
+# query's rarest word (and more words while that stays cheap), ranks the rows by how many
+# keys they share with the query, then by how close their length is, and scores the best
+# few by trigram similarity: every word is padded ("  tolkien ") and cut into overlapping
+# three-letter pieces, and match_score() compares the pieces. The exact name or title is
+# always a candidate too, since a common word is not read. A lookup usually reads a few
+# hundred index entries, which keeps it well under a millisecond with 100,000 authors
+# (benchmark.py measures it); in exchange a row is only found through a word, or all its
+# words run together, within one typo of a word of the query.
+#
+# db.py and importer.py keep the index up to date as they write, through index_author()
+# and index_title(), which also re-index a renamed author or a changed title. Keys are
+# removed with their author or book (ON DELETE CASCADE), and a trigger takes them off the
+# counts.
+
+# default minimum similarity for suggestions
+DEFAULT_THRESHOLD = 0.3
+
+# A lookup reads the index entries of the query's rarest word, unless there are more than
+# MAX_WORD_POSTINGS of them, and of more words while the total stays within MAX_POSTINGS.
+# Of the rows found, the MAX_RANKED sharing the most keys with the query are ranked by
+# length as well, and the best MAX_CANDIDATES of those are scored.
+MAX_WORD_POSTINGS = 3000
+MAX_POSTINGS = 300
+MAX_RANKED = 50
+MAX_CANDIDATES = 20
+
+# words whose trigrams are kept for scoring
+WORD_CACHE_SIZE = 4096
+
+# share of all books above which bulk_index_titles() rebuilds the index by book ID
+REBUILD_SHARE = 0.25
+
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_WORD = re.compile(r"[\W_]+")
+
+# Lowercase words: accents and apostrophes removed, other punctuation splits words
+def normalize(text):
+    text = text or ""
+    # ASCII text has no accents to take off, and most names and titles are ASCII
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+    return " ".join(_NON_WORD.sub(" ", _APOSTROPHES.sub("", text)).split())
+
+def capitalize_words(text):
+    # Capitalize the first letter of each word
+    return ' '.join(word.capitalize() for word in text.split())
+
+# Canonical form of an author name: normalized words with initials joined and sorted
+def name_key(name):
+    words = []
+    initials = ""
+    for word in normalize(name).split():
+        if len(word) == 1 and word.isalpha():
+            initials += word
+            continue
+        if initials:
+            words.append(initials)
+            initials = ""
+        words.append(word)
+    if initials:
+        words.append(initials)
+    return " ".join(sorted(words))
+
+def trigrams(text):
+    return _trigrams(normalize(text))
+
+# trigrams of text that is normalized already, such as a name_key
+def _trigrams(normalized):
+    grams = set()
+    for word in normalized.split():
+        grams |= _word_trigrams(word)
+    return grams
+
+# Trigrams of one word. Lookups score every candidate, and the words of titles (and
+# first names) come up again and again, so the most recent ones are kept.
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def _word_trigrams(word):
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def similarity(a, b):
+    grams_a = a if isinstance(a, set) else trigrams(a)
+    grams_b = b if isinstance(b, set) else trigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+# How well a candidate matches what was typed: the mean of the share of the query's
+# trigrams found in it and their similarity, so "Tolkein" still finds "J.R.R. Tolkien".
+def match_score(query, candidate):
+    if not query or not candidate:
+        return 0.0
+    shared = len(query & candidate)
+    return (shared / len(query) + shared / len(query | candidate)) / 2
+
+# Index keys of one word: the word and every word one deleted letter makes of it
+def _variants(word):
+    if len(word) <= 2:
+        return {word}
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+# Index keys of a normalized name or title: those of its words, in words when given
+# (the words of a name_key), and all its words run together
+def _keys(normalized, words=None):
+    keys = set()
+    for word in (words or normalized).split():
+        keys |= _variants(word)
+    if normalized:
+        keys.add(normalized.replace(" ", ""))
+    return keys
+
+# The indexed tables: key table, its count table, the ID column, the source table,
+# the column whose text is indexed and the column returned by lookup()
+_INDEXES = {
+    "author": ("AuthorVariants", "AuthorVariantCounts", "author_id", "Authors", "name_key", "author_name"),
+    "title": ("TitleVariants", "TitleVariantCounts", "book_id", "Books", "title", "title"),
+}
+
+# Adds the keys of new rows, from (id, normalized text, words) tuples, in key order so
+# the inserts walk the index instead of jumping around it, and adds to the counts once
+# per distinct key. The IDs are grouped by key rather than sorted as pairs, which is
+# much faster for a bulk load.
+def _index(cursor, kind, rows):
+    table, counts_table, id_column = _INDEXES[kind][:3]
+    postings = {}
+    for row_id, normalized, words in rows:
+        for key in _keys(normalized, words):
+            postings.setdefault(key, []).append(row_id)
+    keys = sorted(postings)
+    cursor.executemany(f"INSERT INTO {table} (variant, {id_column}) VALUES (?, ?)",
+                       ((key, row_id) for key in keys for row_id in sorted(postings[key])))
+    cursor.executemany(f'''INSERT INTO {counts_table} (variant, frequency) VALUES (?, ?)
+                         ON CONFLICT (variant) DO UPDATE SET frequency = frequency + excluded.frequency''',
+                       ((key, len(postings[key])) for key in keys))
+
+def _unindex(cursor, kind, row_ids):
+    table, id_column = _INDEXES[kind][0], _INDEXES[kind][2]
+    cursor.executemany(f"DELETE FROM {table} WHERE {id_column} = ?", ((row_id,) for row_id in row_ids))
+
+# Function to index authors, from (author_id, author_name) pairs: sets their name_key and
+# adds its keys. With replace, the keys of their old names are removed first, which is
+# how a renamed author is re-indexed.
+def index_authors(cursor, rows, replace=False):
+    keyed = [(author_id, normalize(name), name_key(name)) for author_id, name in rows]
+    if replace:
+        _unindex(cursor, "author", (author_id for author_id, _, _ in keyed))
+    cursor.executemany("UPDATE Authors SET name_key = ? WHERE author_id = ?", ((key, author_id) for author_id, _, key in keyed))
+    _index(cursor, "author", keyed)
+
+def index_author(cursor, author_id, author_name, replace=False):
+    index_authors(cursor, [(author_id, author_name)], replace)
+
+# Function to index book titles, from (book_id, title) pairs. Titles already indexed are
+# replaced, so this is also how a changed title is re-indexed.
+def index_titles(cursor, rows, replace=False):
+    rows = [(book_id, normalize(title), None) for book_id, title in rows]
+    if replace:
+        _unindex(cursor, "title", (book_id for book_id, _, _ in rows))
+    _index(cursor, "title", rows)
+
+def index_title(cursor, book_id, title, replace=False):
+    index_titles(cursor, [(book_id, title)], replace)
+
+# Function to index the titles of many new books at once, such as a bulk import. When they
+# are at least REBUILD_SHARE of all books, the index of TitleVariants by book ID (see
+# migrations.py) is dropped while they are added and built again afterwards: building it
+# in one go is much faster than inserting each entry into it out of order.
+def bulk_index_titles(cursor, rows):
+    rows = list(rows)
+    rebuild = len(rows) >= REBUILD_SHARE * cursor.execute("SELECT COUNT(*) FROM Books").fetchone()[0]
+    if rebuild:
+        cursor.execute("DROP INDEX IF EXISTS idx_titlevariants_book_id")
+    index_titles(cursor, rows)
+    if rebuild:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_titlevariants_book_id ON TitleVariants (book_id)")
+
+# Function to find the rows most similar to text. kind is "author" or "title". Returns
+# (score, id, author name or title) tuples, best first.
+def lookup(cursor, kind, text, limit=5, threshold=DEFAULT_THRESHOLD):
+    table, counts_table, id_column, source_table, text_column, result_column = _INDEXES[kind]
+    key = name_key(text) if kind == "author" else normalize(text)
+    if not key:
+        return []
+    grams_of = _trigrams if kind == "author" else trigrams
+
+    # the exact match is always a candidate, however common its words are
+    if kind == "author":
+        cursor.execute("SELECT author_id, name_key, author_name FROM Authors WHERE name_key = ?", (key,))
+    else:
+        cursor.execute(f"SELECT book_id, title, title FROM Books WHERE title = ? COLLATE NOCASE LIMIT {limit}",
+                       (text.strip(),))
+    candidates = cursor.fetchall()
+
+    # how many rows have each key of each word, so the rarest words are read first
+    words = [_variants(word) for word in key.split()]
+    variants = set().union(*words)
+    cursor.execute(f"SELECT variant, frequency FROM {counts_table} WHERE variant IN ({', '.join('?' * len(variants))})",
+                   tuple(variants))
+    counts = dict(cursor.fetchall())
+    postings = [sum(counts.get(variant, 0) for variant in word) for word in words]
+    selected = []
+    total = 0
+    for i in sorted(range(len(words)), key=postings.__getitem__):
+        if not postings[i]:
+            continue
+        if total + postings[i] > (MAX_POSTINGS if selected else MAX_WORD_POSTINGS):
+            break
+        selected.extend(variant for variant in words[i] if counts.get(variant))
+        total += postings[i]
+    if selected:
+        cursor.execute(f'''SELECT {source_table}.{id_column}, {source_table}.{text_column}, {source_table}.{result_column}
+                         FROM (SELECT {id_column}, COUNT(*) AS shared FROM {table}
+                               WHERE variant IN ({', '.join('?' * len(selected))})
+                               GROUP BY {id_column} ORDER BY shared DESC LIMIT {MAX_RANKED}) AS ranked
+                         JOIN {source_table} ON {source_table}.{id_column} = ranked.{id_column}
+                         ORDER BY shared DESC, ABS(LENGTH({source_table}.{text_column}) - ?) LIMIT {MAX_CANDIDATES}''',
+                       (*selected, len(key)))
+        candidates.extend(cursor.fetchall())
+
+    query = _trigrams(key)
+    matches = {}
+    for row_id, candidate, result in candidates:
+        score = match_score(query, grams_of(candidate or ""))
+        if score >= threshold:
+            matches[row_id] = (score, row_id, result)
+    return sorted(matches.values(), key=lambda match: (-match[0], match[1]))[:limit]
@@ -0,0 +1,253 @@
+import csv
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from itertools import islice
+
+import db
+import fuzzy
+
+DEFAULT_BATCH_SIZE = 5000
+
+@dataclass
+class ImportReport:
+    rows_read: int = 0
+    books_added: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    authors_added: int = 0
+    categories_added: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"Read {self.rows_read} rows in {self.seconds:.2f}s ({self.rows_per_second:,.0f} rows/sec): "
+                f"{self.books_added} books added, {self.duplicates} duplicates rejected, "
+                f"{self.rejected} invalid rows rejected, {self.authors_added} new authors, "
+                f"{self.categories_added} new categories")
+
+# Function to read rows from a CSV file with a header line (title, author, category)
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+# Function to read rows from a JSON Lines file, one object per line
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def read_rows(path, fmt=None):
+    if fmt is None:
+        fmt = "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+    if fmt == "csv":
+        return read_csv(path)
+    if fmt == "jsonl":
+        return read_jsonl(path)
+    raise ValueError(f"Unknown import format: {fmt}")
+
+# Authors are matched by fuzzy.name_key(), like db.add_book() does, so spelling variants
+# of a known author ("Jrr Tolkien" for "J.R.R. Tolkien") do not become new authors
+def _author_key(author_name):
+    return fuzzy.name_key(author_name) or author_name
+
+def _field(row, *names):
+    for name in names:
+        value = row.get(name)
+        if value is not None and str(value).strip() != "":
+            return str(value).strip()
+    return None
+
+class BulkImporter:
+    # Keeps name->id maps for authors (by name_key) and categories plus the set of existing
+    # (title, author_id, category_id) keys in memory, so a row never needs a SELECT.
+    # Titles are added to the fuzzy index once the whole load is in (see index_titles()):
+    # until then suggest_titles() does not offer the new books.
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, create_categories=True):
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.report = ImportReport()
+        # (first, last) book IDs of the chunks whose titles are not in the fuzzy index yet
+        self.unindexed = []
+
+        with db.reading() as cursor:
+            self.authors = {}
+            for author_id, name in cursor.execute("SELECT author_id, author_name FROM Authors ORDER BY author_id"):
+                self.authors.setdefault(_author_key(name), author_id)
+            self.category_ids = set()
+            self.categories = {}
+            for category_id, name in cursor.execute("SELECT category_id, category_name FROM Categories"):
+                self.category_ids.add(category_id)
+                # insert_category treats category names case-insensitively, so do the same here
+                self.categories.setdefault((name or "").lower(), category_id)
+            self.existing = set(cursor.execute("SELECT title, author_id, category_id FROM Books"))
+
+    def _resolve_category(self, row, new_categories):
+        category_id = _field(row, "category_id")
+        if category_id is not None:
+            try:
+                category_id = int(category_id)
+            except ValueError:
+                return None
+            return category_id if category_id in self.category_ids else None
+
+        name = _field(row, "category", "category_name")
+        if name is None:
+            return None
+        key = name.lower()
+        if key in self.categories:
+            return self.categories[key]
+        if not self.create_categories:
+            return None
+        new_categories.setdefault(key, name)
+        return key  # resolved to a real ID once the new categories are inserted
+
+    # Inserts the names with executemany and reads back the IDs SQLite assigned to them
+    def _insert_names(self, cursor, table, id_column, name_column, names):
+        cursor.execute(f"SELECT COALESCE(MAX({id_column}), 0) FROM {table}")
+        last_id = cursor.fetchone()[0]
+        cursor.executemany(f"INSERT INTO {table} ({name_column}) VALUES (?)", ((name,) for name in names))
+        cursor.execute(f"SELECT {id_column}, {name_column} FROM {table} WHERE {id_column} > ?", (last_id,))
+        return cursor.fetchall()
+
+    def import_chunk(self, rows):
+        pending = []
+        new_authors = {}
+        new_categories = {}
+
+        for row in rows:
+            self.report.rows_read += 1
+            title = _field(row, "title")
+            author_name = _field(row, "author", "author_name")
+            # a new category is only created for a row that is otherwise valid
+            if title is None or author_name is None:
+                self.report.rejected += 1
+                continue
+            category = self._resolve_category(row, new_categories)
+            if category is None:
+                self.report.rejected += 1
+                continue
+            author = _author_key(author_name)
+            if author not in self.authors:
+                new_authors.setdefault(author, author_name)  # the first spelling seen is the one stored
+            pending.append((title, author, category))
+
+        if not pending:
+            return
+
+        # new IDs are only merged into the maps once the chunk has committed
+        author_ids = {}
+        category_ids = {}
+        books = []
+        duplicates = 0
+        with db.transaction() as cursor:
+            if new_authors:
+                inserted = self._insert_names(cursor, "Authors", "author_id", "author_name", new_authors.values())
+                fuzzy.index_authors(cursor, inserted)
+                author_ids = {_author_key(name): author_id for author_id, name in inserted}
+            if new_categories:
+                category_ids = {name.lower(): category_id for category_id, name in
+                                self._insert_names(cursor, "Categories", "category_id", "category_name", new_categories.values())}
+
+            seen = set()
+            for title, author, category in pending:
+                if isinstance(category, str):
+                    category_id = category_ids[category] if category in category_ids else self.categories[category]
+                else:
+                    category_id = category
+                author_id = author_ids[author] if author in author_ids else self.authors[author]
+                key = (title, author_id, category_id)
+                # Same rule as add_book: one book per title, author and category
+                if key in self.existing or key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                books.append(key)
+
+            cursor.execute("SELECT COALESCE(MAX(book_id), 0) FROM Books")
+            last_id = cursor.fetchone()[0]
+            cursor.executemany("INSERT INTO Books (title, author_id, category_id) VALUES (?, ?, ?)", books)
+            cursor.execute("SELECT COALESCE(MAX(book_id), 0) FROM Books")
+            new_books = (last_id + 1, cursor.fetchone()[0])
+
+        if author_ids or category_ids:
+            db.invalidate_caches()
+        self.authors.update(author_ids)
+        self.categories.update(category_ids)
+        self.category_ids.update(category_ids.values())
+        self.existing.update(books)
+        if books:
+            self.unindexed.append(new_books)
+        self.report.authors_added += len(author_ids)
+        self.report.categories_added += len(category_ids)
+        self.report.duplicates += duplicates
+        self.report.books_added += len(books)
+
+    # Adds the titles of the books imported so far to the fuzzy index, in one pass: one
+    # sorted walk through the typo index instead of one per chunk
+    def index_titles(self):
+        if not self.unindexed:
+            return
+        with db.transaction() as cursor:
+            titles = []
+            for first_id, last_id in self.unindexed:
+                cursor.execute("SELECT book_id, title FROM Books WHERE book_id BETWEEN ? AND ?", (first_id, last_id))
+                titles.extend(cursor.fetchall())
+            fuzzy.bulk_index_titles(cursor, titles)
+        self.unindexed = []
+
+    def run(self, rows):
+        start = time.perf_counter()
+        rows = iter(rows)
+        try:
+            while True:
+                chunk = list(islice(rows, self.batch_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+        finally:
+            # the chunks that did commit are indexed even if a later one failed
+            self.index_titles()
+        self.report.seconds += time.perf_counter() - start
+        return self.report
+
+# Function to bulk import books from an iterable of dict rows
+def import_books(rows, batch_size=DEFAULT_BATCH_SIZE, create_categories=True):
+    importer = BulkImporter(batch_size=batch_size, create_categories=create_categories)
+    return importer.run(rows)
+
+# Function to bulk import books from a CSV or JSON Lines file
+def import_file(path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, create_categories=True):
+    return import_books(read_rows(path, fmt), batch_size=batch_size,
+                        create_categories=create_categories)
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk import books from a CSV or JSON Lines feed.")
+    parser.add_argument("path", help="CSV file with a header row, or a .jsonl file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: guessed from the extension)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument("--no-new-categories", action="store_true",
+                        help="reject rows whose category does not exist instead of creating it")
+    args = parser.parse_args(argv)
+
+    try:
+        report = import_file(args.path, fmt=args.format, batch_size=args.batch_size,
+                             create_categories=not args.no_new_categories)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error importing books: {e}")
+        return 1
+    print(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# Timing for the data layer: how long each db.py function and each SQL statement
+# takes, and how many rows it returns or changes.
+#
+#     import instrument
+#     instrument.enable(slow_query_ms=50)
+#     ...
+#     print(instrument.report())
+#     instrument.write_snapshot("metrics.json")
+#
+# Instrumentation is off by default. While it is off, a db.py call costs one extra
+# flag check and cursors are plain sqlite3 cursors, so it can stay wired in permanently
+# and be switched on in production when needed.
+
+logger = logging.getLogger("library.instrument")
+
+# most recent timings kept per function or statement for the percentiles
+SAMPLE_SIZE = 10000
+
+enabled = False
+slow_query_seconds = None
+
+class Timer:
+    # Running totals for one function or statement, plus its most recent durations
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def record(self, seconds, rows, failed):
+        self.count += 1
+        self.errors += failed
+        self.rows += rows
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        percentile = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000 if samples else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": self.max * 1000,
+        }
+
+_lock = threading.Lock()
+_functions = {}
+_statements = {}
+
+def _record(timers, key, seconds, rows, failed=False):
+    with _lock:
+        timer = timers.get(key)
+        if timer is None:
+            timer = timers[key] = Timer()
+        timer.record(seconds, rows, failed)
+
+# Function to switch instrumentation on. Statements slower than slow_query_ms are
+# logged as warnings together with their query plan; None turns the slow-query log off.
+def enable(slow_query_ms=None):
+    global enabled, slow_query_seconds
+    slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+# Function to forget everything recorded so far
+def reset():
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+
+# Function to return the recorded metrics as a JSON-serializable dict
+def snapshot():
+    with _lock:
+        return {
+            "enabled": enabled,
+            "slow_query_ms": slow_query_seconds * 1000 if slow_query_seconds is not None else None,
+            "functions": {name: timer.summary() for name, timer in _functions.items()},
+            "statements": {sql: timer.summary() for sql, timer in _statements.items()},
+        }
+
+# Function to write the current snapshot to a JSON file
+def write_snapshot(path):
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+
+# Function to format the snapshot as a table, slowest total time first
+def report(limit=20):
+    metrics = snapshot()
+    lines = []
+    for title, timers in (("Functions", metrics["functions"]), ("Statements", metrics["statements"])):
+        lines.append(f"{title}:{'':<63}{'count':>8}{'rows':>10}{'total ms':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        ranked = sorted(timers.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        for name, timer in ranked[:limit]:
+            name = name if len(name) <= 72 else name[:69] + "..."
+            lines.append(f"  {name:<72}{timer['count']:>8}{timer['rows']:>10}{timer['total_ms']:>11.1f}"
+                         f"{timer['p50_ms']:>9.2f}{timer['p95_ms']:>9.2f}{timer['p99_ms']:>9.2f}")
+    return "\n".join(lines)
+
+# a function returns either a collection of rows or a single row (or None)
+def _rows(result):
+    if isinstance(result, (list, set, frozenset, dict)):
+        return len(result)
+    return 1 if result is not None else 0
+
+# Decorator that times a data layer function while instrumentation is enabled
+def timed(function):
+    name = function.__name__
+
+    @wraps(function)
+    def call(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            _record(_functions, name, time.perf_counter() - start, 0, True)
+            raise
+        _record(_functions, name, time.perf_counter() - start, _rows(result))
+        return result
+    return call
+
+_whitespace = re.compile(r"\s+")
+
+class TimedCursor(sqlite3.Cursor):
+    # A cursor that times each statement from execute() until its last row is fetched,
+    # counting the rows read (SELECT) or changed (INSERT, UPDATE, DELETE)
+    _sql = None
+
+    def _finish(self):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        rows = self._rows if self._rows or self.rowcount < 0 else self.rowcount
+        _record(_statements, sql, self._elapsed, rows, self._failed)
+        if slow_query_seconds is not None and self._elapsed >= slow_query_seconds:
+            self._log_slow(sql)
+
+    def _log_slow(self, sql):
+        try:
+            plan = [row[-1] for row in self.connection.execute("EXPLAIN QUERY PLAN " + self._statement, self._params)]
+        except sqlite3.Error as e:
+            plan = [f"(no plan: {e})"]
+        logger.warning("Slow query (%.1f ms): %s\n  params: %r\n  plan: %s",
+                       self._elapsed * 1000, sql, self._params, "\n        ".join(plan) or "(none)")
+
+    def _run(self, method, sql, params, many=False):
+        self._finish()
+        self._sql = _whitespace.sub(" ", sql).strip()
+        self._statement = sql
+        self._params = () if many else params
+        self._rows = 0
+        self._failed = False
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        except BaseException:
+            self._failed = True
+            raise
+        finally:
+            self._elapsed = time.perf_counter() - start
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - start
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(super().executemany, sql, seq_of_params, many=True)
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, self.arraysize if size is None else size)
+        if self._sql is not None:
+            self._rows += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._fetch(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._sql is not None:
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+class Connection(sqlite3.Connection):
+    # Connection class for the pool: hands out timing cursors while instrumentation is
+    # enabled and plain ones otherwise. Statements run through conn.execute() directly
+    # (BEGIN, COMMIT, PRAGMAs) are not timed.
+    def cursor(self, factory=sqlite3.Cursor):
+        if enabled and factory is sqlite3.Cursor:
+            factory = TimedCursor
+        return super().cursor(factory)
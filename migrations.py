@@ -0,0 +1,429 @@
+import sqlite3
+import sys
+
+import fuzzy
+
+# Schema and migrations for library.db. The number of migrations applied so far is kept
+# in PRAGMA user_version, so an existing database is upgraded in place the next time
+# it is opened. Append new migrations to the end of MIGRATIONS, never reorder them.
+
+def _create_tables(cursor):
+    # creating the categories table
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Categories (
+        category_id INTEGER PRIMARY KEY,
+        category_name TEXT
+    )''')
+
+    # creating the authors table
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Authors (
+        author_id INTEGER PRIMARY KEY,
+        author_name TEXT
+    )''')
+
+    # creating the books table with foreign keys
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Books (
+        book_id INTEGER PRIMARY KEY,
+        title TEXT,
+        author_id INTEGER,
+        category_id INTEGER,
+        FOREIGN KEY (author_id) REFERENCES Authors (author_id),
+        FOREIGN KEY (category_id) REFERENCES Categories (category_id)
+    )''')
+
+    # creating the reviews table with a foreign key
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Reviews (
+        review_id INTEGER PRIMARY KEY,
+        book_id INTEGER,
+        user_id INTEGER,
+        rating INTEGER,
+        review_text TEXT,
+        FOREIGN KEY (book_id) REFERENCES Books (book_id)
+    )''')
+
+def _add_secondary_indexes(cursor):
+    # The unique index below would fail on databases that already hold the same
+    # author twice, so point their books at the oldest row and drop the copies
+    cursor.execute('''UPDATE Books SET author_id = (
+                        SELECT MIN(a2.author_id) FROM Authors a1
+                        JOIN Authors a2 ON a2.author_name = a1.author_name
+                        WHERE a1.author_id = Books.author_id)
+                    WHERE author_id IN (
+                        SELECT author_id FROM Authors WHERE author_id NOT IN (
+                            SELECT MIN(author_id) FROM Authors GROUP BY author_name))''')
+    cursor.execute('''DELETE FROM Authors WHERE author_id NOT IN (
+                        SELECT MIN(author_id) FROM Authors GROUP BY author_name)''')
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_authors_name ON Authors (author_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_categories_name_nocase ON Categories (category_name COLLATE NOCASE)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_author ON Books (author_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_category ON Books (category_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_title_author_category ON Books (title, author_id, category_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reviews_book ON Reviews (book_id)")
+
+def _add_title_nocase_index(cursor):
+    # case-insensitive title lookups; exact-case lookups use idx_books_title_author_category
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_title_nocase ON Books (title COLLATE NOCASE)")
+
+def _add_book_search(cursor):
+    # Full-text index over titles, author names and review text. Each review is its own
+    # row (rowid = review_id) next to the book's title/author row (rowid = -book_id), so
+    # adding or removing a review touches one row instead of rebuilding the book's whole
+    # review text, and search_books groups the matching rows by book_id.
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS BookSearch USING fts5(
+        title, author_name, review_text, book_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )''')
+    cursor.execute('''INSERT INTO BookSearch (rowid, title, author_name, book_id)
+                    SELECT -Books.book_id, Books.title, Authors.author_name, Books.book_id
+                    FROM Books LEFT JOIN Authors ON Books.author_id = Authors.author_id''')
+    cursor.execute('''INSERT INTO BookSearch (rowid, review_text, book_id)
+                    SELECT review_id, review_text, book_id FROM Reviews''')
+
+    # triggers keep the index in step with Books, Authors and Reviews
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON Books BEGIN
+        INSERT INTO BookSearch (rowid, title, author_name, book_id)
+        VALUES (-new.book_id, new.title, (SELECT author_name FROM Authors WHERE author_id = new.author_id), new.book_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_search_update AFTER UPDATE OF book_id, title, author_id ON Books BEGIN
+        DELETE FROM BookSearch WHERE rowid = -old.book_id;
+        INSERT INTO BookSearch (rowid, title, author_name, book_id)
+        VALUES (-new.book_id, new.title, (SELECT author_name FROM Authors WHERE author_id = new.author_id), new.book_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_search_delete AFTER DELETE ON Books BEGIN
+        DELETE FROM BookSearch WHERE rowid = -old.book_id;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS authors_search_update AFTER UPDATE OF author_name ON Authors BEGIN
+        UPDATE BookSearch SET author_name = new.author_name
+        WHERE rowid IN (SELECT -book_id FROM Books WHERE author_id = new.author_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_search_insert AFTER INSERT ON Reviews BEGIN
+        INSERT INTO BookSearch (rowid, review_text, book_id) VALUES (new.review_id, new.review_text, new.book_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_search_update AFTER UPDATE OF review_id, book_id, review_text ON Reviews BEGIN
+        DELETE FROM BookSearch WHERE rowid = old.review_id;
+        INSERT INTO BookSearch (rowid, review_text, book_id) VALUES (new.review_id, new.review_text, new.book_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_search_delete AFTER DELETE ON Reviews BEGIN
+        DELETE FROM BookSearch WHERE rowid = old.review_id;
+    END''')
+
+def _add_book_stats(cursor):
+    # one row per reviewed book with its review count and rating totals, so listings and
+    # "top rated" queries read a single row instead of aggregating Reviews every time
+    cursor.execute('''CREATE TABLE IF NOT EXISTS BookStats (
+        book_id INTEGER PRIMARY KEY,
+        review_count INTEGER NOT NULL DEFAULT 0,
+        rating_sum REAL NOT NULL DEFAULT 0,
+        avg_rating REAL,
+        last_review_at TEXT
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookstats_rating ON BookStats (avg_rating, review_count)")
+    cursor.execute('''INSERT OR REPLACE INTO BookStats (book_id, review_count, rating_sum, avg_rating)
+                    SELECT book_id, COUNT(*), TOTAL(rating), TOTAL(rating) / COUNT(*)
+                    FROM Reviews WHERE book_id IN (SELECT book_id FROM Books)
+                    GROUP BY book_id''')
+
+    # Reviews has no timestamp column, so last_review_at is the time the trigger saw the
+    # most recent insert; books reviewed before this migration start with NULL
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON Reviews BEGIN
+        INSERT OR IGNORE INTO BookStats (book_id) VALUES (new.book_id);
+        UPDATE BookStats SET review_count = review_count + 1,
+                             rating_sum = rating_sum + COALESCE(new.rating, 0),
+                             avg_rating = (rating_sum + COALESCE(new.rating, 0)) / (review_count + 1),
+                             last_review_at = CURRENT_TIMESTAMP
+        WHERE book_id = new.book_id;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON Reviews BEGIN
+        UPDATE BookStats SET review_count = review_count - 1,
+                             rating_sum = rating_sum - COALESCE(old.rating, 0),
+                             avg_rating = CASE WHEN review_count > 1
+                                               THEN (rating_sum - COALESCE(old.rating, 0)) / (review_count - 1) END
+        WHERE book_id = old.book_id;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_stats_update AFTER UPDATE OF book_id, rating ON Reviews BEGIN
+        UPDATE BookStats SET review_count = review_count - 1,
+                             rating_sum = rating_sum - COALESCE(old.rating, 0),
+                             avg_rating = CASE WHEN review_count > 1
+                                               THEN (rating_sum - COALESCE(old.rating, 0)) / (review_count - 1) END
+        WHERE book_id = old.book_id;
+        INSERT OR IGNORE INTO BookStats (book_id) VALUES (new.book_id);
+        UPDATE BookStats SET review_count = review_count + 1,
+                             rating_sum = rating_sum + COALESCE(new.rating, 0),
+                             avg_rating = (rating_sum + COALESCE(new.rating, 0)) / (review_count + 1)
+        WHERE book_id = new.book_id;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_stats_update AFTER UPDATE OF book_id ON Books BEGIN
+        UPDATE BookStats SET book_id = new.book_id WHERE book_id = old.book_id;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_stats_delete AFTER DELETE ON Books BEGIN
+        DELETE FROM BookStats WHERE book_id = old.book_id;
+    END''')
+
+def _add_book_neighbors(cursor):
+    # "readers who liked this also liked": the top neighbors of each book, computed by
+    # recommend.py, so a recommendation is one primary key range read
+    cursor.execute('''CREATE TABLE IF NOT EXISTS BookNeighbors (
+        book_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        neighbor_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (book_id, rank)
+    ) WITHOUT ROWID''')
+    # the books listing a changed book among their neighbors are recomputed with it
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookneighbors_neighbor ON BookNeighbors (neighbor_id)")
+    # reviews changed since the neighbors were last computed; recommend.refresh_pending()
+    # recomputes the books they touch and removes the entries it has handled. There is
+    # one entry per book and user, however often their reviews change: queueing them
+    # again replaces the entry with a newer one, so a refresh that started before the
+    # change does not remove it.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS NeighborQueue (
+        id INTEGER PRIMARY KEY,
+        book_id INTEGER,
+        user_id INTEGER
+    )''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_neighborqueue_entry ON NeighborQueue (book_id, IFNULL(user_id, -1))")
+    # a user's reviews are read to find which other books a changed review affects
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reviews_user ON Reviews (user_id)")
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_neighbors_insert AFTER INSERT ON Reviews BEGIN
+        INSERT OR REPLACE INTO NeighborQueue (book_id, user_id) VALUES (new.book_id, new.user_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_neighbors_delete AFTER DELETE ON Reviews BEGIN
+        INSERT OR REPLACE INTO NeighborQueue (book_id, user_id) VALUES (old.book_id, old.user_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS reviews_neighbors_update AFTER UPDATE OF book_id, user_id, rating ON Reviews BEGIN
+        INSERT OR REPLACE INTO NeighborQueue (book_id, user_id) VALUES (old.book_id, old.user_id);
+        INSERT OR REPLACE INTO NeighborQueue (book_id, user_id) VALUES (new.book_id, new.user_id);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_neighbors_delete AFTER DELETE ON Books BEGIN
+        DELETE FROM BookNeighbors WHERE book_id = old.book_id;
+    END''')
+    # every existing review counts as new, so the first refresh computes all books
+    cursor.execute("INSERT INTO NeighborQueue (book_id, user_id) SELECT DISTINCT book_id, NULL FROM Reviews")
+
+def _cascade_deletes(cursor):
+    # Deleting a book now deletes its reviews (foreign keys are enforced from this version
+    # on, see pool.py). SQLite cannot change a foreign key in place, so Reviews is copied
+    # into a new table with the new constraint, and its indexes and triggers recreated.
+    cursor.execute("DELETE FROM Reviews WHERE book_id IS NOT NULL AND book_id NOT IN (SELECT book_id FROM Books)")
+    cursor.execute("UPDATE Books SET author_id = NULL WHERE author_id NOT IN (SELECT author_id FROM Authors)")
+    cursor.execute("UPDATE Books SET category_id = NULL WHERE category_id NOT IN (SELECT category_id FROM Categories)")
+
+    cursor.execute("SELECT sql FROM sqlite_master WHERE tbl_name = 'Reviews' AND type IN ('index', 'trigger') AND sql IS NOT NULL")
+    dependents = [sql for sql, in cursor.fetchall()]
+    cursor.execute('''CREATE TABLE Reviews_new (
+        review_id INTEGER PRIMARY KEY,
+        book_id INTEGER,
+        user_id INTEGER,
+        rating INTEGER,
+        review_text TEXT,
+        FOREIGN KEY (book_id) REFERENCES Books (book_id) ON DELETE CASCADE ON UPDATE CASCADE
+    )''')
+    cursor.execute("INSERT INTO Reviews_new SELECT review_id, book_id, user_id, rating, review_text FROM Reviews")
+    cursor.execute("DROP TABLE Reviews")
+    cursor.execute("ALTER TABLE Reviews_new RENAME TO Reviews")
+    for sql in dependents:
+        cursor.execute(sql)
+
+    # authors and categories whose last book went away, for compact.py to check
+    cursor.execute('''CREATE TABLE IF NOT EXISTS CleanupQueue (
+        kind TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (kind, id)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_cleanup_delete AFTER DELETE ON Books BEGIN
+        INSERT OR IGNORE INTO CleanupQueue (kind, id) SELECT 'author', old.author_id WHERE old.author_id IS NOT NULL;
+        INSERT OR IGNORE INTO CleanupQueue (kind, id) SELECT 'category', old.category_id WHERE old.category_id IS NOT NULL;
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS books_cleanup_update AFTER UPDATE OF author_id, category_id ON Books BEGIN
+        INSERT OR IGNORE INTO CleanupQueue (kind, id)
+        SELECT 'author', old.author_id WHERE old.author_id IS NOT new.author_id AND old.author_id IS NOT NULL;
+        INSERT OR IGNORE INTO CleanupQueue (kind, id)
+        SELECT 'category', old.category_id WHERE old.category_id IS NOT new.category_id AND old.category_id IS NOT NULL;
+    END''')
+
+    cursor.execute("PRAGMA foreign_key_check")
+    problems = cursor.fetchall()
+    if problems:
+        raise sqlite3.IntegrityError(f"Foreign key violations after rebuilding Reviews: {problems[:10]}")
+
+def _add_fuzzy_index(cursor):
+    # Normalized author names and typo indexes for fuzzy lookups (see fuzzy.py).
+    # Authors with the same name_key are the same author to db.py.
+    cursor.execute("ALTER TABLE Authors ADD COLUMN name_key TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_authors_name_key ON Authors (name_key)")
+    for table, id_column, parent in (("AuthorVariants", "author_id", "Authors"), ("TitleVariants", "book_id", "Books")):
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            variant TEXT NOT NULL,
+            {id_column} INTEGER NOT NULL,
+            PRIMARY KEY (variant, {id_column}),
+            FOREIGN KEY ({id_column}) REFERENCES {parent} ({id_column}) ON DELETE CASCADE ON UPDATE CASCADE
+        ) WITHOUT ROWID''')
+        # the cascade finds an author's or book's keys through this index
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_{id_column} ON {table} ({id_column})")
+        # how many rows have each key, so a lookup can start from the rarest words
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table[:-1]}Counts (
+            variant TEXT PRIMARY KEY,
+            frequency INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+
+    cursor.execute("SELECT author_id, author_name FROM Authors")
+    fuzzy.index_authors(cursor, cursor.fetchall())
+    cursor.execute("SELECT book_id, title FROM Books")
+    fuzzy.index_titles(cursor, cursor.fetchall())
+
+    # fuzzy.py adds to the counts as it indexes; deletes, which cascade from Authors and
+    # Books, take off through a trigger
+    for table in ("AuthorVariants", "TitleVariants"):
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table.lower()}_count_delete AFTER DELETE ON {table} BEGIN
+            UPDATE {table[:-1]}Counts SET frequency = frequency - 1 WHERE variant = old.variant;
+        END''')
+
+MIGRATIONS = [
+    _add_secondary_indexes,
+    _add_title_nocase_index,
+    _add_book_search,
+    _add_book_stats,
+    _add_book_neighbors,
+    _cascade_deletes,
+    _add_fuzzy_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Function to read the schema version stored in the database file
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Function to apply every migration the database has not seen yet, each in its own transaction
+def migrate(conn):
+    version = get_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+
+    if version == SCHEMA_VERSION:
+        return version  # nothing to do, so opening an up-to-date database runs no DDL
+
+    # the original tables predate user_version, so a database that has never been
+    # migrated may or may not have them yet
+    if version == 0:
+        if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+            # only possible before the first table exists: lets compact.py hand freed pages back
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        _create_tables(conn.cursor())
+        conn.commit()
+
+    # Rebuilding a table drops it, which with foreign keys on would cascade to its children,
+    # so migrations run with them off (the setting cannot change inside a transaction)
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            cursor = conn.cursor()
+            try:
+                # take the write lock first, then re-check: another process may have migrated meanwhile
+                cursor.execute("BEGIN IMMEDIATE")
+                if get_version(conn) < number:
+                    MIGRATIONS[number - 1](cursor)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+    return get_version(conn)
+
+# The hot queries of db.py and the index each of them is expected to use
+QUERY_PLAN_CHECKS = [
+    ("get_books_by_author",
+     "SELECT * FROM Books WHERE author_id IN (SELECT author_id FROM Authors WHERE name_key = ?)",
+     ("",), ["idx_books_author", "idx_authors_name_key"]),
+    ("add_book duplicate check",
+     "SELECT book_id FROM Books WHERE title = ? AND author_id = ? AND category_id = ?",
+     ("", 0, 0), ["idx_books_title_author_category"]),
+    ("author lookup",
+     "SELECT author_id FROM Authors WHERE author_name = ?",
+     ("",), ["idx_authors_name"]),
+    ("insert_category duplicate check",
+     "SELECT category_name FROM Categories WHERE category_name = ? COLLATE NOCASE",
+     ("",), ["idx_categories_name_nocase"]),
+    ("get_recent_reviews",
+     "SELECT * FROM Reviews WHERE book_id = ? ORDER BY review_id DESC LIMIT ?",
+     (0, 3), ["idx_reviews_book"]),
+    ("get_all_books reviews join",
+     '''SELECT Books.book_id, Reviews.rating FROM Books
+        LEFT JOIN Reviews ON Books.book_id = Reviews.book_id''',
+     (), ["idx_reviews_book"]),
+    ("get_all_books by category",
+     "SELECT book_id FROM Books WHERE category_id = ?",
+     (0,), ["idx_books_category"]),
+    ("get_book_by_id",
+     "SELECT title FROM Books WHERE book_id = ?",
+     (0,), ["INTEGER PRIMARY KEY"]),
+    ("find_books_by_title",
+     "SELECT book_id FROM Books WHERE title = ?",
+     ("",), ["idx_books_title_author_category"]),
+    ("find_books_by_title case-insensitive",
+     "SELECT book_id FROM Books WHERE title = ? COLLATE NOCASE",
+     ("",), ["idx_books_title_nocase"]),
+    ("find_books_by_title prefix",
+     "SELECT book_id FROM Books WHERE title >= ? AND title < ?",
+     ("", ""), ["idx_books_title_author_category"]),
+    ("find_books_by_title case-insensitive prefix",
+     "SELECT book_id FROM Books WHERE title >= ? COLLATE NOCASE AND title < ? COLLATE NOCASE",
+     ("", ""), ["idx_books_title_nocase"]),
+    ("get_recommendations",
+     "SELECT neighbor_id, score FROM BookNeighbors WHERE book_id = ? ORDER BY rank LIMIT ?",
+     (0, 10), ["PRIMARY KEY"]),
+    ("author lookup by name_key",
+     "SELECT author_id FROM Authors WHERE name_key = ? ORDER BY author_id LIMIT 1",
+     ("",), ["idx_authors_name_key"]),
+    ("fuzzy lookup",
+     "SELECT author_id FROM AuthorVariants WHERE variant = ?",
+     ("",), ["PRIMARY KEY"]),
+    ("get_top_rated_books",
+     "SELECT book_id FROM BookStats WHERE review_count >= ? ORDER BY avg_rating DESC, review_count DESC LIMIT 10",
+     (1,), ["idx_bookstats_rating"]),
+]
+
+# Function to return the EXPLAIN QUERY PLAN lines for a statement
+def explain(conn, sql, params=()):
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+class QueryPlanError(Exception):
+    pass
+
+# Function to check that every hot query is answered through its index instead of a table
+# scan. Returns the plans by query name, or raises QueryPlanError naming the first query
+# that does not use its index.
+def check_query_plans(conn):
+    plans = {}
+    for name, sql, params, indexes in QUERY_PLAN_CHECKS:
+        plan = explain(conn, sql, params)
+        for index in indexes:
+            if not any(index in line for line in plan):
+                raise QueryPlanError(f"{name} does not use {index}: {plan}")
+        plans[name] = plan
+    return plans
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else "library.db"
+    conn = sqlite3.connect(path)
+    try:
+        before = get_version(conn)
+        after = migrate(conn)
+        print(f"{path}: schema version {before} -> {after}")
+        for name, plan in check_query_plans(conn).items():
+            print(f"{name}: {'; '.join(plan)}")
+    except QueryPlanError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,108 @@
 from dataclasses import dataclass
 
-@dataclass
+# Records returned by db.py, one per result row. They use __slots__, so a record holds
+# just its field values (no per-instance __dict__), which keeps large listings small.
+# Category and Author are frozen because db.py caches them and hands the same objects
+# to every caller; the others are built fresh for each query, and freezing them would
+# roughly double the cost of creating one.
+
+@dataclass(frozen=True, slots=True)
 class Category:
     id: int = 0
     name: str = ""
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Author:
     id: int = 0
     name: str = ""
 
-@dataclass
+@dataclass(slots=True)
 class Book:
     id: int = 0
     title: str = ""
     author_id: int = 0
     category_id: int = 0
 
-@dataclass
+@dataclass(slots=True)
 class Review:
     id: int = 0
     book_id: int = 0
     user_id: int = 0
     rating: int = 0
-    review_text: str = ""
\ No newline at end of file
+    review_text: str = ""
+
+# A book with the names of its author and category
+@dataclass(slots=True)
+class BookDetails:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    category_name: str = ""
+
+# One row of a catalog listing: a book and one of its reviews (rating and
+# review_text are None for a book without reviews)
+@dataclass(slots=True)
+class BookListing:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    category_name: str = ""
+    rating: int = None
+    review_text: str = None
+
+# One row of the grouped catalog listing: a book with the review stats kept in BookStats
+# (avg_rating is None for a book without reviews)
+@dataclass(slots=True)
+class BookSummary:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    category_name: str = ""
+    review_count: int = 0
+    avg_rating: float = None
+
+@dataclass(slots=True)
+class SearchResult:
+    book_id: int = 0
+    title: str = ""
+    author_name: str = ""
+    snippet: str = ""
+
+@dataclass(slots=True)
+class BookStats:
+    book_id: int = 0
+    review_count: int = 0
+    rating_sum: float = 0.0
+    avg_rating: float = 0.0
+    last_review_at: str = None
+
+@dataclass(slots=True)
+class RatedBook:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    avg_rating: float = 0.0
+    review_count: int = 0
+
+# A book recommended from another one; score is the similarity of their ratings (up to 1)
+@dataclass(slots=True)
+class Recommendation:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    score: float = 0.0
+
+# "Did you mean" matches from db.suggest_authors() and db.suggest_titles(); score is the
+# fuzzy.match_score() of the names (up to 1)
+@dataclass(slots=True)
+class AuthorMatch:
+    id: int = 0
+    name: str = ""
+    score: float = 0.0
+
+@dataclass(slots=True)
+class TitleMatch:
+    id: int = 0
+    title: str = ""
+    author_name: str = ""
+    score: float = 0.0
@@ -0,0 +1,113 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+# how long a connection waits for another connection's write lock before giving up
+DEFAULT_BUSY_TIMEOUT = 30.0
+DEFAULT_MAX_CONNECTIONS = 8
+
+# Whether a database URI opens the file read-only (mode=ro or immutable=1)
+def _is_read_only(path, uri):
+    if not uri:
+        return False
+    params = parse_qs(urlsplit(path).query)
+    return "ro" in params.get("mode", ()) or "1" in params.get("immutable", ())
+
+class ConnectionPool:
+    # A bounded pool of SQLite connections that can be shared between threads.
+    #
+    # Connections are opened lazily, in WAL mode so readers never wait for a writer,
+    # with a busy timeout so concurrent writers queue up instead of failing with
+    # "database is locked". A thread that already holds a connection gets the same
+    # one back from nested connection() calls, so it sees its own open transaction.
+    # Read-only databases (mode=ro URIs) are used as they are: they keep their journal
+    # mode and are not initialized, so they must already be up to date.
+    def __init__(self, path, max_connections=DEFAULT_MAX_CONNECTIONS, busy_timeout=DEFAULT_BUSY_TIMEOUT,
+                 initialize=None, uri=False, factory=sqlite3.Connection):
+        self.path = path
+        self.uri = uri
+        self.read_only = _is_read_only(path, uri)
+        self.factory = factory
+        self.busy_timeout = busy_timeout
+        self.max_connections = max_connections
+        self._initialize = initialize  # called once with the first connection, e.g. to migrate the schema
+        self._initialized = False
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self):
+        # isolation_level=None: no implicit transactions, callers BEGIN and COMMIT explicitly
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, uri=self.uri, factory=self.factory)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        # SQLite leaves foreign keys unenforced unless each connection asks for them
+        conn.execute("PRAGMA foreign_keys = ON")
+        with self._lock:
+            if not self._initialized and not self.read_only:
+                try:
+                    if self._initialize is not None:
+                        self._initialize(conn)
+                except BaseException:
+                    conn.close()
+                    raise
+                self._initialized = True
+        # only after initializing: switching to WAL writes the header of a new database
+        # file, after which settings such as auto_vacuum can no longer change
+        if not self.read_only:
+            conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def _checkout(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.busy_timeout):
+            raise sqlite3.OperationalError(f"No free connection after {self.busy_timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            # never hand a half-finished transaction to the next caller
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    # Context manager that lends a connection to the calling thread
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    # Function to close the pool: idle connections now, borrowed ones when they come back
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,277 @@
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import db
+
+logger = logging.getLogger("library.recommend")
+
+# "Readers who liked this also liked": item-item collaborative filtering over Reviews.
+#
+# Ratings form a sparse book x user matrix. Each user's ratings are centered on that
+# user's mean, so a 3 from a harsh reviewer counts as much as a 5 from a generous one,
+# and the similarity of two books is the cosine of their rows (adjusted cosine). The
+# TOP_K most similar books of each book are stored in BookNeighbors, where
+# db.get_recommendations() reads them with a single primary key lookup.
+#
+# Triggers queue every review change in NeighborQueue, one entry per book and user.
+# refresh_pending() recomputes the neighbors of the queued books, of the other books rated
+# by the same users (a changed rating moves its user's mean, and so every book they
+# rated) and of the books that list any of those among their neighbors, whose stored
+# scores are out of date. It only reads the ratings those similarities depend on: the
+# books sharing a reader with them, and the means of those books' readers. One case is
+# left: a changed book can become similar enough to a book that did not list it to enter
+# that book's top TOP_K, which only rebuild() finds. rebuild() recomputes everything from
+# all of Reviews; run it now and then (say nightly) next to the refreshes. Both need
+# NumPy and SciPy, which the rest of the library does not.
+#
+# Something has to empty the queue. ui.py runs refresh_until() while the menu is open
+# (when NumPy and SciPy are installed), but reviews also come from importer.py, batch.py
+# and async_db.py, so a library that shows recommendations needs the watch command below
+# running next to it (or refresh from cron). Without it recommendations go stale, and the
+# queue grows up to one entry per reviewed book and reviewer.
+#
+#     python recommend.py watch [SECONDS]
+#     python recommend.py refresh
+#     python recommend.py rebuild
+#     python recommend.py show 42
+
+TOP_K = 20
+# dirty books whose similarities are computed at once (one sparse product each)
+BLOCK_SIZE = 1024
+# rows read from Reviews per fetch while building the matrix
+FETCH_SIZE = 50000
+# IDs bound per IN (...) list, well below SQLite's limit on query parameters
+ID_CHUNK = 500
+# share of the reviewed books above which a refresh reads all of Reviews in one scan,
+# which is then cheaper than looking the affected books up one by one
+FULL_LOAD_SHARE = 0.25
+# seconds between two refreshes of refresh_until() or the watch command
+REFRESH_INTERVAL = 60.0
+
+# Positions of the given IDs in a sorted array of IDs, leaving out the IDs it does not contain
+def _positions(sorted_ids, ids):
+    ids = np.fromiter(ids, dtype=np.int64)
+    positions = np.searchsorted(sorted_ids, ids)
+    found = positions < len(sorted_ids)
+    positions, ids = positions[found], ids[found]
+    return positions[sorted_ids[positions] == ids]
+
+class RatingMatrix:
+    # Row-normalized, user-centered ratings: rows are books, columns are users. The user
+    # means are taken from the given ratings, unless user_means ({user_id: mean}) has them
+    # because only part of each user's ratings was loaded.
+    def __init__(self, book_ids, user_ids, ratings, user_means=None):
+        self.books, book_rows = np.unique(book_ids, return_inverse=True)
+        self.users, user_columns = np.unique(user_ids, return_inverse=True)
+
+        if user_means is None:
+            counts = np.bincount(user_columns, minlength=len(self.users))
+            means = np.bincount(user_columns, weights=ratings, minlength=len(self.users)) / np.maximum(counts, 1)
+        else:
+            means = np.array([user_means[int(user_id)] for user_id in self.users], dtype=np.float64)
+        values = ratings - means[user_columns]
+
+        matrix = sparse.csr_matrix((values, (book_rows, user_columns)), shape=(len(self.books), len(self.users)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        self.matrix = sparse.diags(scale, format="csr") @ matrix
+
+    # Array of matrix rows for the given book IDs; books without ratings are skipped
+    def rows_of(self, book_ids):
+        return _positions(self.books, book_ids)
+
+    # Yields (book_id, [(rank, neighbor_id, score), ...]) for the given rows, computing
+    # the similarities of BLOCK_SIZE books at a time as one sparse matrix product
+    def neighbors(self, rows, k=TOP_K):
+        transposed = self.matrix.T.tocsc()
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            similarities = (self.matrix[block] @ transposed).tocsr()
+            for i, row in enumerate(block):
+                begin, end = similarities.indptr[i], similarities.indptr[i + 1]
+                columns = similarities.indices[begin:end]
+                scores = similarities.data[begin:end]
+                keep = (scores > 0) & (columns != row)
+                columns, scores = columns[keep], scores[keep]
+                if len(scores) > k:
+                    top = np.argpartition(-scores, k)[:k]
+                    columns, scores = columns[top], scores[top]
+                order = np.argsort(-scores, kind="stable")
+                yield int(self.books[row]), [(rank, int(self.books[column]), float(score)) for rank, (column, score)
+                                             in enumerate(zip(columns[order], scores[order]), start=1)]
+
+# one rating per (user, book): a user who reviewed a book twice counts with their average
+_RATINGS = '''SELECT book_id, user_id, AVG(rating) FROM Reviews
+              WHERE rating IS NOT NULL AND user_id IS NOT NULL
+                AND EXISTS (SELECT 1 FROM Books WHERE Books.book_id = Reviews.book_id) {where}
+              GROUP BY book_id, user_id'''
+
+def _matrix(chunks, user_means=None):
+    data = np.concatenate(chunks) if chunks else np.empty((0, 3))
+    return RatingMatrix(data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2], user_means)
+
+def _load(cursor):
+    cursor.execute(_RATINGS.format(where=""))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    return _matrix(chunks)
+
+# Runs sql once per ID_CHUNK of ids, with the chunk bound to its {ids} list, and returns all the rows
+def _select_in(cursor, sql, ids):
+    ids = sorted(ids)
+    rows = []
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        cursor.execute(sql.format(ids=", ".join("?" * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+# Loads what the neighbors of the changed books depend on: the ratings of every book that
+# shares a reader with them (through idx_reviews_user and idx_reviews_book) and the mean
+# rating of each of those books' readers. When that is a large part of the catalog (a
+# bestseller links most books to each other) it loads everything instead. Returns the
+# matrix and the IDs of the changed books: the queued ones, every book rated by a queued
+# user and every book listing one of those among its neighbors (idx_bookneighbors_neighbor).
+def _load_affected(cursor, book_ids, user_ids):
+    changed = set(book_ids)
+    changed.update(book_id for book_id, in _select_in(
+        cursor, "SELECT DISTINCT book_id FROM Reviews WHERE user_id IN ({ids})", user_ids))
+    changed.update(book_id for book_id, in _select_in(
+        cursor, "SELECT DISTINCT book_id FROM BookNeighbors WHERE neighbor_id IN ({ids})", changed))
+    readers = {user_id for user_id, in _select_in(
+        cursor, "SELECT DISTINCT user_id FROM Reviews WHERE book_id IN ({ids}) AND user_id IS NOT NULL", changed)}
+    related = changed | {book_id for book_id, in _select_in(
+        cursor, "SELECT DISTINCT book_id FROM Reviews WHERE user_id IN ({ids})", readers)}
+    cursor.execute("SELECT COUNT(*) FROM BookStats WHERE review_count > 0")
+    if len(related) > cursor.fetchone()[0] * FULL_LOAD_SHARE:
+        return _load(cursor), changed
+
+    ratings = _select_in(cursor, _RATINGS.format(where="AND book_id IN ({ids})"), related)
+    chunks = [np.array(ratings, dtype=np.float64)] if ratings else []
+    raters = {user_id for _, user_id, _ in ratings}
+    user_means = dict(_select_in(cursor, '''SELECT user_id, AVG(rating) FROM (
+                                             SELECT user_id, AVG(rating) AS rating FROM Reviews
+                                             WHERE user_id IN ({ids}) AND rating IS NOT NULL
+                                               AND EXISTS (SELECT 1 FROM Books WHERE Books.book_id = Reviews.book_id)
+                                             GROUP BY user_id, book_id)
+                                         GROUP BY user_id''', raters))
+    return _matrix(chunks, user_means), changed
+
+# Replaces the stored neighbors of the given books, one transaction per block of books,
+# so writers only ever wait for one block
+def _store(matrix, rows, book_ids):
+    stored = 0
+    remaining = set(book_ids)
+    pending = []
+    def flush():
+        with db.transaction() as cursor:
+            cursor.executemany("DELETE FROM BookNeighbors WHERE book_id = ?", ((book_id,) for book_id, _ in pending))
+            cursor.executemany("INSERT INTO BookNeighbors (book_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)",
+                               ((book_id, rank, neighbor_id, score)
+                                for book_id, neighbors in pending for rank, neighbor_id, score in neighbors))
+        pending.clear()
+
+    for book_id, neighbors in matrix.neighbors(rows):
+        remaining.discard(book_id)
+        pending.append((book_id, neighbors))
+        stored += 1
+        if len(pending) >= BLOCK_SIZE:
+            flush()
+    # books that have no ratings left lose their neighbors
+    pending.extend((book_id, []) for book_id in remaining)
+    if pending:
+        flush()
+    return stored
+
+# Function to recompute the neighbors of the books affected by queued review changes.
+# Returns the number of books recomputed.
+def refresh_pending():
+    with db.reading() as cursor:
+        # read the queue and the ratings from one snapshot, so nothing queued after it is dropped
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("SELECT MAX(id) FROM NeighborQueue")
+            last_id = cursor.fetchone()[0]
+            if last_id is None:
+                return 0
+            cursor.execute("SELECT DISTINCT book_id, user_id FROM NeighborQueue WHERE id <= ?", (last_id,))
+            queued = cursor.fetchall()
+            book_ids = {book_id for book_id, _ in queued if book_id is not None}
+            user_ids = {user_id for _, user_id in queued if user_id is not None}
+            matrix, book_ids = _load_affected(cursor, book_ids, user_ids)
+        finally:
+            cursor.execute("COMMIT")
+
+    refreshed = _store(matrix, matrix.rows_of(book_ids), book_ids)
+
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM NeighborQueue WHERE id <= ?", (last_id,))
+    return refreshed
+
+# Function to recompute the neighbors of every book from scratch
+def rebuild():
+    with db.reading() as cursor:
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("SELECT MAX(id) FROM NeighborQueue")
+            last_id = cursor.fetchone()[0]
+            cursor.execute("SELECT DISTINCT book_id FROM BookNeighbors")
+            stale = {book_id for book_id, in cursor.fetchall()}
+            matrix = _load(cursor)
+        finally:
+            cursor.execute("COMMIT")
+
+    rows = np.arange(len(matrix.books))
+    rebuilt = _store(matrix, rows, stale | {int(book_id) for book_id in matrix.books})
+    if last_id is not None:
+        with db.transaction() as cursor:
+            cursor.execute("DELETE FROM NeighborQueue WHERE id <= ?", (last_id,))
+    return rebuilt
+
+# Function to call refresh_pending() every interval seconds until stopped (a
+# threading.Event) is set. ui.py runs it in a background thread while the menu is open.
+def refresh_until(stopped, interval=REFRESH_INTERVAL):
+    while not stopped.wait(interval):
+        try:
+            refresh_pending()
+        except Exception as e:
+            logger.error("Error refreshing recommendations: %s", e)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "refresh"
+    try:
+        start = time.perf_counter()
+        if command == "refresh":
+            print(f"Refreshed recommendations for {refresh_pending()} books in {time.perf_counter() - start:.2f}s.")
+        elif command == "rebuild":
+            print(f"Rebuilt recommendations for {rebuild()} books in {time.perf_counter() - start:.2f}s.")
+        elif command == "watch" and len(argv) <= 2:
+            interval = float(argv[1]) if len(argv) == 2 else REFRESH_INTERVAL
+            print(f"Refreshing recommendations every {interval:g}s, Ctrl+C to stop.")
+            print(f"Refreshed recommendations for {refresh_pending()} books.")
+            try:
+                refresh_until(threading.Event(), interval)
+            except KeyboardInterrupt:
+                pass
+        elif command == "show" and len(argv) == 2:
+            for book in db.get_recommendations(int(argv[1])):
+                print(f"{book.score:.3f}  Book ID: {book.id}, Title: {book.title}, Author: {book.author_name}")
+        else:
+            print("Usage: python recommend.py [watch [SECONDS]|refresh|rebuild|show BOOK_ID]")
+            return 2
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
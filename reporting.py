@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import db
+import export
+
+# Analytics reports computed by a pool of worker processes, away from interactive traffic.
+#
+#     with ReportRunner(processes=4) as reports:
+#         for row in reports.author_leaderboard(limit=20):
+#             print(row)
+#
+# Each worker opens its own read-only connection (a mode=ro URI) to the library database,
+# or to a snapshot copy refreshed every snapshot_max_age seconds, and never touches the
+# application's connection pool. A report is split into book_id ranges, the workers
+# aggregate one range at a time, and the partial results are merged here. In WAL mode
+# the readers never block writers, so heavy reports scale across cores while the
+# application keeps its latency.
+
+# book_id ranges per worker process, so a slow range does not leave the others idle
+PARTITIONS_PER_PROCESS = 4
+
+# Partial aggregates per book_id range. Each query reads the range through the primary
+# key of Books or idx_reviews_book, and sums (not averages) so partials can be added up.
+_PARTIAL_QUERIES = {
+    "categories": '''SELECT Books.category_id, COUNT(*), TOTAL(BookStats.review_count), TOTAL(BookStats.rating_sum)
+                     FROM Books LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                     WHERE Books.book_id BETWEEN ? AND ?
+                     GROUP BY Books.category_id''',
+    "authors": '''SELECT Books.author_id, COUNT(*), TOTAL(BookStats.review_count), TOTAL(BookStats.rating_sum)
+                  FROM Books LEFT JOIN BookStats ON Books.book_id = BookStats.book_id
+                  WHERE Books.book_id BETWEEN ? AND ?
+                  GROUP BY Books.author_id''',
+    "ratings": '''SELECT rating, COUNT(*), 0, 0 FROM Reviews
+                  WHERE book_id BETWEEN ? AND ?
+                  GROUP BY rating''',
+}
+
+# Opens a read-only connection. path is a file name, or a URI when uri is True.
+def _connect_read_only(path, uri):
+    if not uri:
+        path = "file:" + os.path.abspath(path)
+    separator = "&" if "?" in path else "?"
+    return sqlite3.connect(f"{path}{separator}mode=ro", uri=True, check_same_thread=False)
+
+# the worker process's connection and the (path, uri, version) it was opened for
+_worker_conn = None
+_worker_source = None
+
+def _partial(source, query, first_id, last_id):
+    global _worker_conn, _worker_source
+    if source != _worker_source:
+        # first task, or the snapshot was refreshed since this worker last read it
+        if _worker_conn is not None:
+            _worker_conn.close()
+        _worker_conn = _connect_read_only(source[0], source[1])
+        _worker_source = source
+    rows = _worker_conn.execute(_PARTIAL_QUERIES[query], (first_id, last_id)).fetchall()
+    return {key: (count, reviews, rating_sum) for key, count, reviews, rating_sum in rows}
+
+class ReportRunner:
+    # A pool of reporting processes. With snapshot_max_age set, the workers read a snapshot
+    # copy made with export.snapshot() instead of the live database, refreshed before a
+    # report once it is older than that many seconds.
+    def __init__(self, processes=None, snapshot_max_age=None):
+        live = db.get_pool()
+        if live.path == ":memory:" or (live.uri and "mode=memory" in live.path):
+            raise ValueError("Reports need a database file; an in-memory database cannot be shared between processes")
+        # the first pooled connection migrates the schema, which read-only workers cannot do
+        with live.connection():
+            pass
+        self.processes = processes or os.cpu_count() or 1
+        self.snapshot_max_age = snapshot_max_age
+        self._live = (live.path, live.uri)
+        self._snapshot_dir = None
+        self._snapshot_time = None
+        self._version = 0
+        self._pool = multiprocessing.get_context("spawn").Pool(self.processes)
+
+    def _source(self):
+        if self.snapshot_max_age is None:
+            return self._live + (0,)
+        if self._snapshot_time is None or time.monotonic() - self._snapshot_time > self.snapshot_max_age:
+            if self._snapshot_dir is None:
+                self._snapshot_dir = tempfile.TemporaryDirectory(prefix="library-snapshot-")
+            self._version += 1
+            path = os.path.join(self._snapshot_dir.name, f"library-{self._version}.db")
+            export.snapshot(path)
+            if self._version > 1:
+                # workers still reading the previous copy keep it open until they switch
+                previous = os.path.join(self._snapshot_dir.name, f"library-{self._version - 1}.db")
+                os.remove(previous)
+            self._snapshot_time = time.monotonic()
+        return (os.path.join(self._snapshot_dir.name, f"library-{self._version}.db"), False, self._version)
+
+    # Runs one partial query over every book_id range and adds up the results per key
+    def _aggregate(self, query):
+        source = self._source()
+        first_id, last_id = self._query(source, "SELECT MIN(book_id), MAX(book_id) FROM Books")[0]
+        if first_id is None:
+            return {}, source
+
+        partitions = self.processes * PARTITIONS_PER_PROCESS
+        step = max(1, (last_id - first_id + partitions) // partitions)
+        ranges = [(source, query, start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)]
+        totals = {}
+        for partial in self._pool.starmap(_partial, ranges):
+            for key, values in partial.items():
+                current = totals.get(key)
+                totals[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+        return totals, source
+
+    # Small lookups (ID ranges, names) run here on a short-lived read-only connection
+    def _query(self, source, sql):
+        conn = _connect_read_only(source[0], source[1])
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def _names(self, source, sql):
+        return dict(self._query(source, sql))
+
+    # Function to count books and reviews per category. Returns
+    # (category_id, category_name, book_count, review_count, avg_rating) rows, biggest first.
+    def category_counts(self):
+        totals, source = self._aggregate("categories")
+        names = self._names(source, "SELECT category_id, category_name FROM Categories")
+        rows = [(category_id, names.get(category_id), books, int(reviews), rating_sum / reviews if reviews else None)
+                for category_id, (books, reviews, rating_sum) in totals.items()]
+        return sorted(rows, key=lambda row: (-row[2], row[0] if row[0] is not None else -1))
+
+    # Function to rank authors by the number of reviews their books received. Returns
+    # (author_id, author_name, book_count, review_count, avg_rating) rows.
+    def author_leaderboard(self, limit=10, min_reviews=1):
+        totals, source = self._aggregate("authors")
+        ranked = sorted(((author_id, books, int(reviews), rating_sum / reviews)
+                         for author_id, (books, reviews, rating_sum) in totals.items() if reviews >= min_reviews),
+                        key=lambda row: (-row[2], -row[3]))[:limit]
+        names = self._names(source, "SELECT author_id, author_name FROM Authors")
+        return [(author_id, names.get(author_id), books, reviews, avg_rating)
+                for author_id, books, reviews, avg_rating in ranked]
+
+    # Function to count reviews per rating value. Returns a Counter {rating: number of reviews}.
+    def rating_histogram(self):
+        totals, _ = self._aggregate("ratings")
+        return Counter({rating: count for rating, (count, _, _) in totals.items()})
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        if self._snapshot_dir is not None:
+            self._snapshot_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run analytics reports on the library database.")
+    parser.add_argument("report", choices=["categories", "authors", "ratings"])
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--limit", type=int, default=10, help="authors shown by the authors report")
+    parser.add_argument("--snapshot", action="store_true", help="read a snapshot copy instead of the live database")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        with ReportRunner(args.processes, snapshot_max_age=0 if args.snapshot else None) as reports:
+            if args.report == "categories":
+                for category_id, name, books, reviews, avg_rating in reports.category_counts():
+                    rating = f"{avg_rating:.2f}" if avg_rating is not None else "N/A"
+                    print(f"{category_id!s:<6}{name or 'N/A':<30}{books:>10} books{reviews:>10} reviews  avg {rating}")
+            elif args.report == "authors":
+                for author_id, name, books, reviews, avg_rating in reports.author_leaderboard(args.limit):
+                    print(f"{author_id!s:<8}{name or 'N/A':<30}{books:>8} books{reviews:>10} reviews  avg {avg_rating:.2f}")
+            else:
+                histogram = reports.rating_histogram()
+                for rating in sorted(histogram, key=lambda rating: (rating is None, rating)):
+                    print(f"{rating!s:<6}{histogram[rating]:>10}")
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error running report: {e}")
+        return 1
+    finally:
+        db.close()
+    print(f"Finished in {time.perf_counter() - start:.2f}s.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import sys
+
+import db
+
+# BookStats is kept current by triggers on Reviews (see migrations.py). These helpers
+# recompute it from scratch and compare it against Reviews, e.g. after a bulk load
+# done with the triggers dropped or a database restored from an old backup.
+
+# the stored rating sum is updated incrementally, so allow for floating point drift
+TOLERANCE = 1e-6
+
+# Function to recompute BookStats from Reviews, keeping the recorded last review times
+def rebuild_book_stats():
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM BookStats WHERE book_id NOT IN (SELECT book_id FROM Books)")
+        cursor.execute('''INSERT OR REPLACE INTO BookStats (book_id, review_count, rating_sum, avg_rating, last_review_at)
+                        SELECT Reviews.book_id, COUNT(*), TOTAL(Reviews.rating), TOTAL(Reviews.rating) / COUNT(*),
+                               (SELECT last_review_at FROM BookStats WHERE BookStats.book_id = Reviews.book_id)
+                        FROM Reviews
+                        WHERE Reviews.book_id IN (SELECT book_id FROM Books)
+                        GROUP BY Reviews.book_id''')
+        rebuilt = cursor.rowcount
+        cursor.execute('''UPDATE BookStats SET review_count = 0, rating_sum = 0, avg_rating = NULL
+                        WHERE NOT EXISTS (SELECT 1 FROM Reviews WHERE Reviews.book_id = BookStats.book_id)''')
+    return rebuilt
+
+# Function to list the books whose BookStats row disagrees with their reviews.
+# Returns (book_id, stored_count, stored_sum, actual_count, actual_sum) tuples.
+def check_book_stats():
+    with db.reading() as cursor:
+        cursor.execute('''SELECT r.book_id, COALESCE(s.review_count, 0), COALESCE(s.rating_sum, 0), r.review_count, r.rating_sum
+                        FROM (SELECT book_id, COUNT(*) AS review_count, TOTAL(rating) AS rating_sum
+                              FROM Reviews WHERE book_id IN (SELECT book_id FROM Books) GROUP BY book_id) AS r
+                        LEFT JOIN BookStats AS s ON s.book_id = r.book_id
+                        WHERE s.book_id IS NULL OR s.review_count != r.review_count OR abs(s.rating_sum - r.rating_sum) > ?
+                        UNION ALL
+                        SELECT s.book_id, s.review_count, s.rating_sum, 0, 0
+                        FROM BookStats AS s
+                        WHERE (s.review_count != 0 OR s.rating_sum != 0)
+                          AND NOT EXISTS (SELECT 1 FROM Reviews WHERE Reviews.book_id = s.book_id)''', (TOLERANCE,))
+        return cursor.fetchall()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "check"
+    if command == "rebuild":
+        print(f"Rebuilt stats for {rebuild_book_stats()} books.")
+    elif command == "check":
+        problems = check_book_stats()
+        for book_id, stored_count, stored_sum, count, total in problems:
+            print(f"Book ID {book_id}: stored {stored_count} reviews / {stored_sum} total, actual {count} reviews / {total} total")
+        print(f"{len(problems)} inconsistent books.")
+        return 1 if problems else 0
+    else:
+        print("Usage: python stats.py [check|rebuild]")
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
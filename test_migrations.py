@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import subprocess
+
+import pytest
+
+import migrations
+
+# library.db as first committed, before any migration (schema version 0)
+BASELINE_COMMIT = "9c8badc"
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    try:
+        data = subprocess.run(["git", "show", f"{BASELINE_COMMIT}:library.db"], capture_output=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("the baseline library.db is only available in a git checkout")
+    path = tmp_path / "library.db"
+    path.write_bytes(data)
+    conn = sqlite3.connect(path)
+    yield conn
+    conn.close()
+
+# Adds what the baseline lacks: a second "Tana French" with a book of their own, and
+# reviews, one of them for a book that does not exist
+def _seed(conn):
+    conn.execute("INSERT INTO Authors (author_id, author_name) VALUES (6, 'Tana French')")
+    conn.execute("INSERT INTO Books (book_id, title, author_id, category_id) VALUES (2, 'The Likeness', 6, 1)")
+    conn.execute("INSERT INTO Books (book_id, title, author_id, category_id) VALUES (3, 'Curtain', 2, 1)")
+    conn.executemany("INSERT INTO Reviews (review_id, book_id, user_id, rating, review_text) VALUES (?, ?, ?, ?, ?)",
+                     [(1, 1, 7, 5, "Gripping"), (2, 1, 8, 3, "Slow start"), (3, 2, 7, 4, "Better"),
+                      (4, 99, 7, 1, "Lost book")])
+    conn.commit()
+
+# Names of the indexes and triggers on a table
+def _dependents(conn, table):
+    return {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger')",
+                                           (table,))}
+
+def test_baseline_migrates_to_current_version(baseline_db):
+    _seed(baseline_db)
+    assert migrations.get_version(baseline_db) == 0
+    assert migrations.migrate(baseline_db) == migrations.SCHEMA_VERSION
+    plans = migrations.check_query_plans(baseline_db)
+    assert set(plans) == {name for name, _, _, _ in migrations.QUERY_PLAN_CHECKS}
+    assert baseline_db.execute("PRAGMA foreign_key_check").fetchall() == []
+    # a second run finds nothing to do
+    assert migrations.migrate(baseline_db) == migrations.SCHEMA_VERSION
+
+def test_duplicate_authors_are_merged(baseline_db):
+    _seed(baseline_db)
+    migrations.migrate(baseline_db)
+    assert baseline_db.execute("SELECT author_id FROM Authors WHERE author_name = 'Tana French'").fetchall() == [(1,)]
+    assert baseline_db.execute("SELECT author_id FROM Books WHERE book_id = 2").fetchone() == (1,)
+    assert baseline_db.execute("SELECT author_id FROM Books WHERE book_id = 3").fetchone() == (2,)
+    with pytest.raises(sqlite3.IntegrityError):
+        baseline_db.execute("INSERT INTO Authors (author_name) VALUES ('Tana French')")
+
+def test_reviews_copy_keeps_rows_indexes_and_triggers(baseline_db, monkeypatch):
+    _seed(baseline_db)
+    # stop just before _cascade_deletes rebuilds Reviews
+    monkeypatch.setattr(migrations, "SCHEMA_VERSION", migrations.MIGRATIONS.index(migrations._cascade_deletes))
+    migrations.migrate(baseline_db)
+    before = _dependents(baseline_db, "Reviews")
+    assert {"idx_reviews_book", "reviews_stats_insert", "reviews_stats_delete"} <= before
+    monkeypatch.undo()
+
+    migrations.migrate(baseline_db)
+    assert _dependents(baseline_db, "Reviews") == before
+    # the review of a book that does not exist is the only one dropped
+    assert baseline_db.execute("SELECT review_id, book_id, user_id, rating, review_text FROM Reviews ORDER BY review_id").fetchall() == [
+        (1, 1, 7, 5, "Gripping"), (2, 1, 8, 3, "Slow start"), (3, 2, 7, 4, "Better")]
+    (on_delete,) = {row[6] for row in baseline_db.execute("PRAGMA foreign_key_list(Reviews)")}
+    assert on_delete == "CASCADE"
+
+def test_review_triggers_work_after_the_copy(baseline_db):
+    _seed(baseline_db)
+    migrations.migrate(baseline_db)
+    baseline_db.execute("PRAGMA foreign_keys = ON")
+    stats = "SELECT review_count, rating_sum FROM BookStats WHERE book_id = ?"
+    assert baseline_db.execute(stats, (1,)).fetchone() == (2, 8)
+
+    baseline_db.execute("INSERT INTO Reviews (book_id, user_id, rating, review_text) VALUES (3, 9, 2, 'Predictable')")
+    assert baseline_db.execute(stats, (3,)).fetchone() == (1, 2)
+    assert baseline_db.execute("SELECT COUNT(*) FROM BookSearch WHERE BookSearch MATCH 'predictable'").fetchone() == (1,)
+
+    baseline_db.execute("DELETE FROM Books WHERE book_id = 1")
+    assert baseline_db.execute("SELECT COUNT(*) FROM Reviews WHERE book_id = 1").fetchone() == (0,)
+    assert baseline_db.execute(stats, (1,)).fetchone() is None
+    assert baseline_db.execute("SELECT COUNT(*) FROM BookSearch WHERE BookSearch MATCH 'gripping'").fetchone() == (0,)
+    assert baseline_db.execute("SELECT kind, id FROM CleanupQueue").fetchall() == [("author", 1), ("category", 1)]
@@ -1,68 +1,146 @@
-import sqlite3
 from db import (
-    insert_category, update_book_title, delete_review, get_books_by_author,
-    add_book, add_author, add_review, get_categories, get_all_books, delete_book, 
-    get_review_by_id, update_book_author, update_book_category
+    insert_category, delete_review, get_books_by_author, add_book, add_author, add_review,
+    get_categories, get_category_ids, delete_book, get_review_by_id, update_book, iter_book_summary_pages, get_recent_reviews, get_recommendations, get_book_by_id, find_books_by_title,
+    search_books, suggest_authors, suggest_titles, find_author, rename_author, close
 )
+import sys
 import textwrap
-from colorama import Fore, Style # for my text coloring
+import threading
+from itertools import chain
 
-conn = sqlite3.connect('library.db')
-cursor = conn.cursor()
+from fuzzy import capitalize_words, normalize
+
+# colorama is only imported the first time something is printed in color, so
+# starting the program (or importing this module) does not pay for it
+def colored(text, color):
+    from colorama import Fore, Style # for my text coloring
+    return getattr(Fore, color) + text + Style.RESET_ALL
 
 def view_categories():
     categories = get_categories()
     if not categories:
-        print(Fore.RED + "No categories found." + Style.RESET_ALL)
+        print(colored("No categories found.", "RED"))
     else:
-        print(Fore.CYAN + "Categories:" + Style.RESET_ALL)
+        print(colored("Categories:", "CYAN"))
         for category in categories:
-            print(f"ID: {category[0]}, Category: {category[1]}")
+            print(f"ID: {category.id}, Category: {category.name}")
             print("=" * 25)
     print()
 
+# Prints a listing one page at a time, only fetching the next page when the user asks for it
+def show_pages(pages, print_row):
+    page = next(pages, None)
+    while page:
+        for row in page:
+            print_row(row)
+        page = next(pages, None)
+        if page and input("Press Enter for more, or 'q' to stop: ").strip().lower() == 'q':
+            break
+
+# Listing rows show one line per book, with its number of reviews and average rating
+def print_book_row(book):
+    book_id = book.id
+    book_title = book.title if book.title else "N/A"
+    author_name = book.author_name if book.author_name else "N/A"
+    category_name = book.category_name if book.category_name else "N/A"
+    rating = f"{book.avg_rating:.1f}" if book.avg_rating is not None else "N/A"
+
+    # wrapping the book title to a maximum width (in this case 40 characters)
+    wrapped_title = textwrap.fill(book_title, width=40)
+
+    print(f"{book_id:<6}{wrapped_title:<40}{author_name:<20}{category_name:<15}{book.review_count:<9}{rating:<8}")
+
+# Lets the user open the latest reviews of books from a listing, one book at a time,
+# along with the books liked by the same readers
+def show_recent_reviews():
+    while True:
+        book_id = input("Enter a book ID to see its latest reviews, or press Enter to go back: ").strip()
+        if not book_id:
+            return
+        try:
+            book_id = int(book_id)
+        except ValueError:
+            print("Error: Please enter a valid numeric book ID.")
+            continue
+        reviews = get_recent_reviews(book_id)
+        if not reviews:
+            print(f"No reviews found for book ID {book_id}.")
+        for review in reviews:
+            print(f"  Review ID: {review.id}, User ID: {review.user_id}, Rating: {review.rating}")
+            print(f"    {review.review_text}")
+        recommendations = get_recommendations(book_id, limit=5)
+        if recommendations:
+            print("  Readers who liked this also liked:")
+            for book in recommendations:
+                print(f"    Book ID: {book.id}, Title: {book.title}, Author: {book.author_name}")
+
 def view_all_books():
-    books = get_all_books()
-    if not books:
-        print(Fore.RED + "No books found." + Style.RESET_ALL)
+    pages = iter_book_summary_pages()
+    first_page = next(pages, None)
+    if not first_page:
+        print(colored("No books found.", "RED"))
     else:
         print("All Books:")
-        print(f"{'ID':<4}{'Book':<40}{'Author':<20}{'Category':<15}{'Rating':<8}{'Review':<50}")
+        print(f"{'ID':<6}{'Book':<40}{'Author':<20}{'Category':<15}{'Reviews':<9}{'Rating':<8}")
         print("=" * 100)
-        for book in books:
-            book_id = book[0]
-            book_title = book[1] if book[1] else "N/A"
-            author_name = book[2] if book[2] else "N/A"
-            category_name = book[3] if book[3] else "N/A"
-            rating = book[4] if book[4] is not None else "N/A"
-            review = book[5] if book[5] else "N/A"
-
-            # wrapping the book title to a maximum width (in this case 40 characters)
-            wrapped_title = textwrap.fill(book_title, width=40)
-
-            print(f"{book_id:<4}{wrapped_title:<40}{author_name:<20}{category_name:<15}{rating:<8}{review:<50}")
-            print("=" * 100)
+        show_pages(chain([first_page], pages), print_book_row)
+        print("=" * 100)
+        show_recent_reviews()
     print()
 
-def capitalize_words(text):
-    # Capitalize the first letter of each word
-    return ' '.join(word.capitalize() for word in text.split())
+def print_book_id_row(book):
+    book_id = book.id
+    book_title = book.title if book.title else "N/A"
+
+    # wrapping the book title to a maximum width (in this case 40 characters)
+    wrapped_title = textwrap.fill(book_title, width=40)
+
+    print(f"{book_id:<4}{wrapped_title:<40}")
 
 def view_books_with_ids():
-    books = get_all_books()
-    if not books:
+    pages = iter_book_summary_pages()
+    first_page = next(pages, None)
+    if not first_page:
         print("No books found.")
     else:
         print("Books:")
         print(f"{'ID':<4}{'Book':<40}")
-        for book in books:
-            book_id = book[0]
-            book_title = book[1] if book[1] else "N/A"
-
-            # wrapping the book title to a maximum width (in this case 40 characters)
-            wrapped_title = textwrap.fill(book_title, width=40)
+        show_pages(chain([first_page], pages), print_book_id_row)
+
+# Offers existing authors whose names look like author_name, so a misspelled name does
+# not create a second author. Returns the name to use: a picked author's, or author_name.
+def choose_author(author_name):
+    matches = suggest_authors(author_name, limit=3)
+    if not matches or matches[0].score == 1.0:
+        return author_name  # unknown, or the same author spelled differently, which add_book handles
+    print("Did you mean:")
+    for number, match in enumerate(matches, start=1):
+        print(f"  {number}. {match.name}")
+    choice = input(f"Enter a number, or press Enter to add '{author_name}' as a new author: ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(matches):
+        return matches[int(choice) - 1].name
+    return author_name
+
+# A name typed for an existing author but spelled differently ("Jrr Tolkien" for
+# "J.R.R. Tolkien") is that author, so offers to store the spelling that was typed.
+# A name that only differs in case or accents ("agatha christie") is not worth asking about.
+def offer_author_rename(author_name):
+    author = find_author(author_name)
+    if author is None or normalize(author.name) == normalize(author_name):
+        return
+    confirm = input(f"'{author_name}' is the author '{author.name}'. Change their name to '{author_name}'? (y/n): ").strip().lower()
+    if confirm == 'y':
+        if rename_author(author.id, author_name):
+            print("Author renamed.")
+        else:
+            print("Error: Failed to rename the author.")
 
-            print(f"{book_id:<4}{wrapped_title:<40}")
+def print_title_suggestions(title):
+    matches = suggest_titles(title, limit=5)
+    if matches:
+        print("Did you mean:")
+        for match in matches:
+            print(f"  Book ID: {match.id}, Title: {match.title}, Author: {match.author_name}")
 
 def main_menu():
     while True:
@@ -78,21 +156,20 @@ def main_menu():
         print("9. Search Books by Category")
         print("10. View All Books")
         print("11. View Categories")
-        print("12. Exit")
+        print("12. Search Books")
+        print("13. Exit")
 
         choice = input("Enter your choice: ")
 
         if choice == "1":
             title = input("Enter the book title: ")
             author_name = input("Enter the author's name: ")
-            author_name = capitalize_words(author_name)
+            author_name = choose_author(capitalize_words(author_name))
 
             while True:
                 category_id = int(input("Enter the category ID: "))
-                existing_categories = get_categories()
-                existing_category_ids = [category[0] for category in existing_categories]
 
-                if category_id in existing_category_ids:
+                if category_id in get_category_ids():
                     break  # Exit the loop if the category is valid
                 else:
                     print("Error: Invalid category ID. Please try again.")
@@ -135,7 +212,7 @@ def main_menu():
             book_id = int(input("Enter the book ID: "))
 
             # Check if the book exists before allowing the review
-            book = [book for book in get_all_books() if book[0] == book_id]
+            book = get_book_by_id(book_id)
             if not book:
                 print(f"Error: No book found with ID {book_id}.")
                 continue
@@ -162,14 +239,18 @@ def main_menu():
         elif choice == "5":
             book_name = input("Enter the book name: ")
             book_name = capitalize_words(book_name)
-            books = [book for book in get_all_books() if book[1] == book_name]
+            books = find_books_by_title(book_name, case_insensitive=True)
+            if not books:
+                # no exact match, so offer the books whose title starts with what was typed
+                books = find_books_by_title(book_name, case_insensitive=True, prefix=True)
             if not books:
                 print(f"Error: No book found with the name '{book_name}'.")
+                print_title_suggestions(book_name)
                 continue
 
             # Display book details and confirm with the user
             for book in books:
-                book_id, book_title, author_name, category_name = book[0], book[1], book[2], book[3]
+                book_id, book_title, author_name, category_name = book.id, book.title, book.author_name, book.category_name
                 print(f"Book ID: {book_id}")
                 print(f"Book Name: {book_title}")
                 print(f"Author: {author_name}")
@@ -186,16 +267,17 @@ def main_menu():
             if confirm == 'y':
                 new_title = input("Enter a new title: ")
                 new_author_name = input("Enter a new author name: ")
+                offer_author_rename(new_author_name)
                 new_category_id = int(input("Enter a new category ID: "))
-                if new_category_id not in existing_category_ids:
+                if new_category_id not in get_category_ids():
                     print("Error: Invalid category ID.")
                     continue
 
-                # Update the book details
-                update_book_title(book_id, new_title)
-                update_book_author(book_id, new_author_name)
-                update_book_category(book_id, new_category_id)
-                print("Book details updated successfully.")
+                # Update the book details in one transaction, so either all of them change or none do
+                if update_book(book_id, new_title, new_author_name, new_category_id):
+                    print("Book details updated successfully.")
+                else:
+                    print("Error: Failed to update the book.")
 
         elif choice == "6":
             review_id = int(input("Enter the review ID: "))
@@ -204,11 +286,11 @@ def main_menu():
             review = get_review_by_id(review_id)
             if review:
                 print("Review Details: ")
-                print(f"Review ID: {review[0]}")
-                print(f"Book ID: {review[1]}")
-                print(f"User ID: {review[2]}")
-                print(f"Rating: {review[3]}")
-                print(f"Review Text: {review[4]}")
+                print(f"Review ID: {review.id}")
+                print(f"Book ID: {review.book_id}")
+                print(f"User ID: {review.user_id}")
+                print(f"Rating: {review.rating}")
+                print(f"Review Text: {review.review_text}")
                 
                 # asking user for confirmation next
                 confirmation = input("Do you want to delete this review? (y/n): ").strip().lower()
@@ -235,8 +317,13 @@ def main_menu():
             author_name = input("Enter the author's name: ")
             author_name = capitalize_words(author_name)
             books = get_books_by_author(author_name)
+            if not books:
+                print(f"No books found by '{author_name}'.")
+                matches = suggest_authors(author_name)
+                if matches:
+                    print("Did you mean: " + ", ".join(match.name for match in matches))
             for book in books:
-                print(f"Book ID: {book[0]}, Title: {book[1]}")
+                print(f"Book ID: {book.id}, Title: {book.title}")
        
         elif choice == "9":
             view_categories()
@@ -244,35 +331,35 @@ def main_menu():
                 category_id = input("Enter a Category ID: ")
                 try:
                     category_id = int(category_id)
-                    existing_categories = get_categories()
-                    existing_category_ids = [category[0] for category in existing_categories]
 
-                    if category_id in existing_category_ids:
+                    if category_id in get_category_ids():
                         break  # Exit the loop if the category is valid
                     else:
                         print("Error: Invalid category ID. Please try again.")
                 except ValueError:
                     print("Error: Please enter a valid numeric category ID.")
 
-            # Display books in the selected category
-            books_in_category = [book for book in get_all_books(category_id)]
-            category_name = next((cat[1] for cat in existing_categories if cat[0] == category_id), "N/A")
+            # Display books in the selected category, one page at a time
+            pages = iter_book_summary_pages(category_id)
+            first_page = next(pages, None)
+            category_name = next((cat.name for cat in get_categories() if cat.id == category_id), "N/A")
 
-            if not books_in_category:
+            if not first_page:
                 print(f"No books found in '{category_name}'.")
             else:
                 print(f"Books in '{category_name}':")
-                print(f"{'ID':<4}{'Book':<40}{'Author':<20}{'Rating':<8}{'Review':<50}")
+                print(f"{'ID':<6}{'Book':<40}{'Author':<20}{'Reviews':<9}{'Rating':<8}")
                 print("=" * 100)  
-                for book in books_in_category:
-                    book_id = book[0]
-                    book_title = book[1] if book[1] else "N/A"
-                    author_name = book[2] if book[2] else "N/A"
-                    rating = book[4] if book[4] is not None else "N/A"
-                    review = book[5] if book[5] else "N/A"
+                def print_category_row(book):
+                    book_id = book.id
+                    book_title = book.title if book.title else "N/A"
+                    author_name = book.author_name if book.author_name else "N/A"
+                    rating = f"{book.avg_rating:.1f}" if book.avg_rating is not None else "N/A"
                     wrapped_title = textwrap.fill(book_title, width=40)
-                    print(f"{book_id:<4}{wrapped_title:<40}{author_name:<20}{rating:<8}{review:<50}")
+                    print(f"{book_id:<6}{wrapped_title:<40}{author_name:<20}{book.review_count:<9}{rating:<8}")
+                show_pages(chain([first_page], pages), print_category_row)
                 print("=" * 100)  
+                show_recent_reviews()
                 print()
 
         elif choice == "10":
@@ -282,12 +369,105 @@ def main_menu():
             view_categories()
 
         elif choice == "12":
+            query = input("Search titles, authors and reviews: ")
+            results = search_books(query)
+            if not results:
+                print(f"No books found matching '{query}'.")
+                print_title_suggestions(query)
+            for result in results:
+                print(f"Book ID: {result.book_id}, Title: {result.title}, Author: {result.author_name}")
+                print(f"    {result.snippet}")
+            print()
+
+        elif choice == "13":
             break
 
         else:
             print("Invalid choice. Please try again.")
 
-if __name__ == "__main__":
-    main_menu()
+# Subcommands run one menu operation without prompts, e.g.
+#     python ui.py add-review --book-id 12 --user-id 7 --rating 4.5 --review-text "Lovely"
+# and 'batch' runs a file of them in one transaction (see batch.py). Each subcommand
+# maps to a batch operation: its options become the fields of the command.
+COMMANDS = {
+    "add-book": ("add_book", [("--title", str, True), ("--author", str, True), ("--category-id", int, True)]),
+    "add-author": ("add_author", [("--name", str, True)]),
+    "add-category": ("add_category", [("--name", str, True)]),
+    "add-review": ("add_review", [("--book-id", int, True), ("--user-id", int, True), ("--rating", float, True),
+                                  ("--review-text", str, False)]),
+    "update-book": ("update_book", [("--book-id", int, True), ("--title", str, False), ("--author", str, False),
+                                    ("--category-id", int, False)]),
+    "delete-review": ("delete_review", [("--review-id", int, True)]),
+    "delete-book": ("delete_book", [("--book-id", int, True)]),
+    "books-by-author": ("books_by_author", [("--author", str, True)]),
+    "books-by-category": ("books_by_category", [("--category-id", int, True)]),
+    "search": ("search", [("--query", str, True), ("--limit", int, False)]),
+}
+
+class RecommendationRefresh(threading.Thread):
+    # Keeps the "also liked" recommendations current in the background while the menu
+    # runs. recommend.py needs NumPy and SciPy, which take about half a second to import,
+    # so the thread imports it rather than the menu; without them it does nothing.
+    def __init__(self):
+        super().__init__(name="recommend-refresh", daemon=True)
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            import recommend
+        except ImportError:
+            return
+        recommend.refresh_until(self._stopped)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def start_recommendation_refresh():
+    refresh = RecommendationRefresh()
+    refresh.start()
+    return refresh
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Library Management System. Without a command, shows the menu.")
+    commands = parser.add_subparsers(dest="command")
+    batch_parser = commands.add_parser("batch", help="run a JSON Lines file of commands in one transaction")
+    batch_parser.add_argument("path", help="file with one JSON command per line, or - for standard input")
+    batch_parser.add_argument("--atomic", action="store_true", help="roll back every command if one fails")
+    for name, (_, options) in COMMANDS.items():
+        command_parser = commands.add_parser(name)
+        for option, option_type, required in options:
+            command_parser.add_argument(option, type=option_type, required=required)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command is None:
+            refresh = start_recommendation_refresh()
+            try:
+                main_menu()
+            finally:
+                refresh.stop()
+            return 0
+
+        import batch
+        if args.command == "batch":
+            try:
+                batch_commands = list(batch.read_commands(args.path))
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}")
+                return 2
+            return batch.run_and_print(batch_commands, atomic=args.atomic)
+        op, options = COMMANDS[args.command]
+        command = {"op": op}
+        for option, _, _ in options:
+            field = option[2:].replace("-", "_")
+            if getattr(args, field) is not None:
+                command[field] = getattr(args, field)
+        return batch.run_and_print([command])
+    finally:
+        close()
 
-conn.close()
+if __name__ == "__main__":
+    sys.exit(main())